@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import scipy
+
+from benchmarks.synthetic import make_video
+from src.camera_motion import CameraMotionModel, estimate_z_transition
+from src.frame_generator import FrameGeneratorVideo
+from src.grid_optical_flow import get_grid_flow, FLOW_MODES
+from src.optical_flow import get_displacements
+from src.segmnet import segment_view, segment_visit, segment_view_batch, segment_visit_batch, count_view_segments
+from src.utils import view_sparse_segmentation_to_df, visit_sparse_segmentation_to_df
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
+
+GRID_SIZE = (5, 10)
+# The z transitions of the synthetic videos are within about 0.99 and 1.01, the zoom phases are labelled
+# transitions with this threshold. The smoothed visits and transitions last about 60 frames.
+TRANSITION_THRESHOLD = 1.0001
+MOTION_THRESHOLD = 50
+MIN_VIEW_SECTION_LENGTH = 25
+MIN_VISIT_SECTION_LENGTH = 50
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="benchmark the optical flow and segmentation hot paths "
+                                                 "on synthetic videos")
+    parser.add_argument("--resolutions", nargs="+", type=str, default=["320x240", "640x480", "1280x720"],
+                        help="video resolutions as WIDTHxHEIGHT")
+    parser.add_argument("--lengths", nargs="+", type=int, default=[150, 600], help="number of frames of the videos")
+    parser.add_argument("--flow-frames", type=int, default=100,
+                        help="number of frame pairs the optical flow benchmarks run on")
+    parser.add_argument("--video-dir", type=str, default=os.path.join(tempfile.gettempdir(), "egovideo-benchmarks"),
+                        help="folder the synthetic videos are written to")
+    parser.add_argument("--output", "-o", type=str, default="benchmark_results.json", help="path of the results")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="results of an earlier run, the speedups and the changed outputs are reported")
+    args = parser.parse_args()
+    return args
+
+
+def _digest(*arrays):
+    """ sha1 of the content of numpy arrays, used to detect changed outputs."""
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def _measure(fn, n_items, repeat=3):
+    """ Runs fn repeat times to take the best time, then once more with tracemalloc tracing its peak memory.
+
+    Returns
+    -------
+        - the result of fn
+        - a dictionary with the time, the throughput and the peak traced memory
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"seconds": seconds, "items_per_s": n_items / seconds, "peak_mb": peak / 2 ** 20}
+
+
+def _read_frames(video_file, grid_size):
+    return list(FrameGeneratorVideo(video_file, show_video_info=False, grid_size=grid_size, grayscale=True))
+
+
+def benchmark_video(video_file, ground_truth, flow_frames):
+    """ Run the benchmarks on one synthetic video.
+
+    Returns
+    -------
+        - a list of result dictionaries
+        - a dictionary with the digest of the output of each benchmark
+        - a dictionary with the checks against the batch implementations and the ground truth
+    """
+    motion_types, translations, _ = ground_truth
+    n_rows, n_cols = GRID_SIZE
+    frames = _read_frames(video_file, GRID_SIZE)
+    pairs = list(zip(frames[:-1], frames[1:]))
+    flow_pairs = pairs[:flow_frames]
+    results, outputs, checks = [], {}, {}
+
+    def add(name, stats, n_items, output=None):
+        results.append(dict(stats, benchmark=name, items=n_items))
+        if output is not None:
+            outputs[name] = output
+
+    _, stats = _measure(lambda: [get_displacements(*pair) for pair in flow_pairs], len(flow_pairs))
+    add("get_displacements", stats, len(flow_pairs))
+
+    for mode in FLOW_MODES:
+        flow, stats = _measure(lambda: [get_grid_flow(*pair, n_rows, n_cols, mode=mode) for pair in flow_pairs],
+                               len(flow_pairs))
+        add("get_grid_flow[{}]".format(mode), stats, len(flow_pairs), _digest(*[np.float32(f) for f in flow]))
+
+    # The segmentation runs on the flow of the whole video, duplicating the flow of the first frame.
+    flow = [get_grid_flow(*pair, n_rows, n_cols) for pair in pairs]
+    optical_flow = np.array(flow[:1] + flow, dtype=np.float32)
+    vectors = optical_flow[:, 1] - optical_flow[:, 0]
+    error = np.abs(vectors.mean(axis=(1, 2)) - translations)
+    is_translation = np.array(motion_types) == "translation"
+    checks["flow_error_px"] = {motion_type: float(error[np.array(motion_types) == motion_type].mean())
+                               for motion_type in sorted(set(motion_types))}
+
+    n_frames = len(optical_flow)
+    z, stats = _measure(lambda: [estimate_z_transition(o, d) for o, d in optical_flow], n_frames)
+    z_raw = np.array(z)
+    add("estimate_z_transition", stats, n_frames, _digest(z_raw))
+    z = np.abs(z_raw)
+    checks["mean_abs_z_transition"] = {motion_type: float(z[np.array(motion_types) == motion_type].mean())
+                                       for motion_type in sorted(set(motion_types))}
+    checks["translation_frames"] = int(is_translation.sum())
+
+    model = CameraMotionModel(optical_flow[0, 0])
+    z_model, stats = _measure(lambda: [model.z_transition(d) for d in optical_flow[:, 1]], n_frames)
+    add("CameraMotionModel.z_transition", stats, n_frames)
+    checks["camera_motion_model_z_matches"] = bool(np.allclose(z_model, z_raw))
+    motion, stats = _measure(lambda: [model.estimate_motion(d) for d in optical_flow[:, 1]], n_frames)
+    add("CameraMotionModel.estimate_motion", stats, n_frames, _digest(np.array(motion)))
+    pan_error = np.linalg.norm(np.array(motion)[:, 1:3] - translations, axis=1)
+    checks["pan_error_px"] = {motion_type: float(pan_error[np.array(motion_types) == motion_type].mean())
+                              for motion_type in sorted(set(motion_types))}
+
+    view, stats = _measure(lambda: np.array(list(segment_view(optical_flow, MOTION_THRESHOLD))), n_frames)
+    add("segment_view", stats, n_frames, _digest(view))
+    view_batch, stats = _measure(lambda: segment_view_batch(optical_flow, MOTION_THRESHOLD), n_frames)
+    add("segment_view_batch", stats, n_frames, _digest(view_batch))
+
+    visit, stats = _measure(lambda: np.array(list(segment_visit(optical_flow, TRANSITION_THRESHOLD))), n_frames)
+    add("segment_visit", stats, n_frames, _digest(visit))
+    visit_batch, stats = _measure(lambda: segment_visit_batch(optical_flow, TRANSITION_THRESHOLD), n_frames)
+    add("segment_visit_batch", stats, n_frames, _digest(visit_batch))
+
+    checks["segment_view_batch_matches"] = bool(np.array_equal(view, view_batch))
+    checks["segment_visit_batch_matches"] = bool(np.array_equal(visit, visit_batch))
+
+    view_segmentation = count_view_segments(visit, view)
+    view_df, stats = _measure(lambda: view_sparse_segmentation_to_df(view_segmentation, MIN_VIEW_SECTION_LENGTH),
+                              n_frames)
+    add("view_sparse_segmentation_to_df", stats, n_frames,
+        hashlib.sha1(view_df.to_csv().encode()).hexdigest())
+    visit_df, stats = _measure(lambda: visit_sparse_segmentation_to_df(visit, MIN_VISIT_SECTION_LENGTH), n_frames)
+    add("visit_sparse_segmentation_to_df", stats, n_frames,
+        hashlib.sha1(visit_df.to_csv().encode()).hexdigest())
+    checks["view_segments"] = len(view_df)
+    checks["visit_segments"] = len(visit_df)
+    return results, outputs, checks
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(resolutions, lengths, flow_frames, video_dir):
+    os.makedirs(video_dir, exist_ok=True)
+    report = {"commit": _git_commit(),
+              "platform": platform.platform(),
+              "python": sys.version.split()[0],
+              "numpy": np.__version__,
+              "scipy": scipy.__version__,
+              "opencv": cv2.__version__,
+              "videos": []}
+    for resolution in resolutions:
+        width, height = map(int, resolution.split("x"))
+        for n_frames in lengths:
+            video_file = os.path.join(video_dir, "synthetic_{}x{}_{}.avi".format(width, height, n_frames))
+            logging.info("Benchmarking {0}".format(video_file))
+            ground_truth = make_video(video_file, (width, height), n_frames)
+            results, outputs, checks = benchmark_video(video_file, ground_truth, flow_frames)
+            for result in results:
+                logging.info("  {benchmark}: {items_per_s:.1f} items/s, peak {peak_mb:.1f}MB".format(**result))
+            if not (checks["segment_view_batch_matches"] and checks["segment_visit_batch_matches"]):
+                logging.error("  the batch segmentation differs from segment_view/segment_visit")
+            if checks["visit_segments"] <= 1:
+                logging.error("  the visit segmentation has a single segment, it does not test the segmentation")
+            report["videos"].append({"video": os.path.basename(video_file), "resolution": [width, height],
+                                     "frames": n_frames, "results": results, "outputs": outputs, "checks": checks})
+    return report
+
+
+def compare(report, previous):
+    """ Log the speedup of every benchmark and the outputs which changed since a previous report.
+
+    Returns
+    -------
+        True if all the outputs are unchanged
+    """
+    unchanged = True
+    previous_videos = {video["video"]: video for video in previous["videos"]}
+    for video in report["videos"]:
+        if video["video"] not in previous_videos:
+            continue
+        old = previous_videos[video["video"]]
+        old_results = {result["benchmark"]: result for result in old["results"]}
+        for result in video["results"]:
+            if result["benchmark"] in old_results:
+                logging.info("{0} {1}: {2:.2f}x".format(video["video"], result["benchmark"],
+                                                        result["items_per_s"] / old_results[result["benchmark"]]["items_per_s"]))
+        for name, digest in video["outputs"].items():
+            if name in old["outputs"] and old["outputs"][name] != digest:
+                logging.error("{0} {1}: the output changed".format(video["video"], name))
+                unchanged = False
+    return unchanged
+
+
+if __name__ == "__main__":
+    args = parseargs()
+    report = run_benchmarks(args.resolutions, args.lengths, args.flow_frames, args.video_dir)
+    with open(args.output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    if args.compare is not None:
+        with open(args.compare, "r") as handle:
+            if not compare(report, json.load(handle)):
+                sys.exit(1)
@@ -0,0 +1,45 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from src.utils import view_sparse_segmentation_to_df, visit_sparse_segmentation_to_df
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="benchmark the *_sparse_segmentation_to_df converters")
+    parser.add_argument("--frames", type=int, default=10 ** 6, help="number of frames in the synthetic labels")
+    parser.add_argument("--flip-probability", type=float, default=0.1,
+                        help="probability of a label change on each frame")
+    parser.add_argument("--min-length", type=float, default=25, help="minimum segment length")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    return args
+
+
+def synthetic_labels(frames, flip_probability, seed=0):
+    """ Noisy per-frame labels: visit labels (bool) and view segment indices (int)."""
+    rng = np.random.RandomState(seed)
+    view_labels = np.cumsum(rng.rand(frames) < flip_probability)
+    visit_labels = view_labels % 2 == 0
+    return visit_labels, view_labels
+
+
+def benchmark(frames, flip_probability, min_length, seed):
+    visit_labels, view_labels = synthetic_labels(frames, flip_probability, seed)
+    logging.info("{} frames, {} label changes".format(frames, view_labels[-1]))
+
+    for name, fn, labels in [("visit_sparse_segmentation_to_df", visit_sparse_segmentation_to_df, visit_labels),
+                             ("view_sparse_segmentation_to_df", view_sparse_segmentation_to_df, view_labels)]:
+        start = time.perf_counter()
+        df = fn(labels, min_length)
+        elapsed = time.perf_counter() - start
+        logging.info("{}: {:.3f}s, {} segments".format(name, elapsed, len(df)))
+
+
+if __name__ == "__main__":
+    args = parseargs()
+    benchmark(args.frames, args.flip_probability, args.min_length, args.seed)
@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+
+MOTION_TYPES = ("static", "translation", "zoom")
+
+
+def make_texture(width, height, seed=0):
+    """ A random blurred grayscale texture with plenty of corners to track."""
+    rng = np.random.RandomState(seed)
+    texture = (rng.rand(height, width) * 255).astype(np.uint8)
+    return cv2.GaussianBlur(texture, (0, 0), 2)
+
+
+def motion_plan(n_frames, phase_length=25, translation=(3.0, 1.0), zoom=1.01):
+    """ The camera motion of each frame of a synthetic video.
+
+    The motion cycles through static, translation, static, zoom in, static and zoom out phases
+    of phase_length frames, so the scale returns to 1 after every cycle. The translation changes
+    direction in every other cycle.
+
+    Parameters
+    ----------
+    n_frames: int
+        number of frames
+    phase_length: int, Optional
+        number of frames in each phase
+    translation: Tuple(float), Optional
+        (dx, dy) movement of the scene content in pixels per frame during translation phases
+    zoom: float, Optional
+        scale change per frame during zoom phases
+
+    Returns
+    -------
+        - a list with the motion type of each frame, see MOTION_TYPES
+        - a numpy array of shape (n_frames, 2) with the content translation of each frame
+        - a numpy array of shape (n_frames,) with the scale change of each frame
+    """
+    phases = [("static", 1.0), ("translation", 1.0), ("static", 1.0), ("zoom", zoom), ("static", 1.0),
+              ("zoom", 1 / zoom)]
+    motion_types, translations, scales = [], np.zeros((n_frames, 2)), np.ones(n_frames)
+    for i in range(n_frames):
+        motion_type, scale = phases[(i // phase_length) % len(phases)]
+        # The first frame has no motion.
+        if i == 0:
+            motion_type, scale = "static", 1.0
+        motion_types.append(motion_type)
+        scales[i] = scale
+        if motion_type == "translation":
+            # The direction alternates between the cycles, so the camera does not leave the texture.
+            direction = 1 if (i // (phase_length * len(phases))) % 2 == 0 else -1
+            translations[i] = direction * np.asarray(translation)
+    return motion_types, translations, scales
+
+
+def make_video(video_file, resolution, n_frames, fps=25.0, seed=0, **plan_params):
+    """ Write a deterministic synthetic video of a textured plane seen by a moving camera.
+
+    Parameters
+    ----------
+    video_file: str
+        path of the .avi file to write (MJPG)
+    resolution: Tuple(int)
+        (width, height) of the video
+    n_frames: int
+        number of frames
+    fps: float, Optional
+    seed: int, Optional
+        seed of the texture
+    plan_params:
+        see motion_plan
+
+    Returns
+    -------
+        the ground truth of motion_plan
+    """
+    width, height = resolution
+    motion_types, translations, scales = motion_plan(n_frames, **plan_params)
+    texture = make_texture(3 * width, 3 * height, seed)
+    writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+
+    # The camera looks at (cx, cy) of the texture and shows it magnified by scale.
+    cx, cy, scale = 1.5 * width, 1.5 * height, 1.0
+    for i in range(n_frames):
+        scale *= scales[i]
+        cx -= translations[i, 0] / scale
+        cy -= translations[i, 1] / scale
+        inverse_map = np.array([[1 / scale, 0, cx - width / 2 / scale],
+                                [0, 1 / scale, cy - height / 2 / scale]])
+        frame = cv2.warpAffine(texture, inverse_map, (width, height), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    writer.release()
+    return motion_types, translations, scales
@@ -0,0 +1,86 @@
+import argparse
+import logging
+import os
+import textwrap
+
+from src import profiling
+from src.flow_store import FlowStoreWriter
+from src.frame_generator import FrameGeneratorVideo, FrameGeneratorImageSequence
+from src.grid_optical_flow import TRACKER_MODES
+from src.multires_flow import compute_multires_flow, get_runs
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                     description=textwrap.dedent(
+                                         '''compute the optical flow of a video sampled every few frames and at full
+                                         frame rate only around the segment boundaries. The flow file can be
+                                         segmented with run_segmentation.py like the one of calculate_optica_flow.py'''))
+    parser.add_argument('--video', '-v', type=str, help="path to the videofile")
+    parser.add_argument("--video_type", type=str, default="video", choices=["video", "image_sequence"],
+                        help="Type of the video source")
+    parser.add_argument("--output-dir", "-o", type=str,
+                        help="Folder where the optical flow is saved")
+    parser.add_argument(
+        "--grid-size",
+        "-g",
+        nargs="+",
+        type=int,
+        help="A touple representing the nrows and ncols of the grid.",
+    )
+    parser.add_argument("--flow-mode", type=str, default="block", choices=TRACKER_MODES,
+                        help="Optical flow mode, see calculate_optica_flow.py")
+    parser.add_argument("--working-resolution", nargs=2, type=int, default=None,
+                        help="Width and height the frames are resized to before computing the optical flow.\n"
+                             "The resolution is shrunk to be divisible by the grid.")
+    parser.add_argument('--transition-threshold', type=float,
+                        help="The threshold parameter for visit segmentation used to find the boundaries")
+    parser.add_argument('--motion-threshold', type=float,
+                        help="The threshold parameter for view segmentation used to find the boundaries")
+    parser.add_argument("--coarse-stride", type=int, default=10,
+                        help="Number of frames between the flow samples of the coarse pass.")
+    parser.add_argument("--window", type=int, default=None,
+                        help="Number of frames refined before and after each boundary, defaults to the stride.")
+    parser.add_argument("--motion-tolerance", type=float, default=0.5,
+                        help="The frames between two flow samples are refined if the grid displacements of the\n"
+                             "samples differ by more than this many pixels on average. Lower values follow a\n"
+                             "full frame rate computation more closely on noisy footage.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save the time spent in each processing stage and the peak memory usage\n"
+                             "to <name>_profile.json and <name>_profile.csv in the output folder.")
+
+    args = parser.parse_args()
+    return args
+
+
+def calculate_multires_flow(video, video_type, grid_size, output_dir, transition_threshold, motion_threshold,
+                            flow_mode="block", working_resolution=None, coarse_stride=10, window=None,
+                            motion_tolerance=0.5):
+    if video_type == "video":
+        fg = FrameGeneratorVideo(video, show_video_info=True, working_resolution=working_resolution,
+                                 grid_size=grid_size, grayscale=True)
+    elif video_type == "image_sequence":
+        fg = FrameGeneratorImageSequence(video, working_resolution=working_resolution,
+                                         grid_size=grid_size, grayscale=True)
+
+    origins, vectors, refined = compute_multires_flow(fg, grid_size, transition_threshold, motion_threshold,
+                                          stride=coarse_stride, window=window, motion_tolerance=motion_tolerance,
+                                          flow_mode=flow_mode)
+
+    store = FlowStoreWriter(os.path.join(output_dir, "optical_flow.npy"), len(vectors), grid_size[0], grid_size[1],
+                            source=video, resolution=list(fg.resolution), fps=getattr(fg, "fps", None), stride=1,
+                            coarse_stride=coarse_stride,
+                            refined_ranges=[[int(start), int(stop)] for start, stop in get_runs(refined)])
+    store.append_vectors(origins, vectors)
+    store.metadata["last_frame"] = len(vectors) - 1
+    store.metadata["complete"] = True
+    store.close()
+    logging.info("Optical flow computation Done!")
+
+
+if __name__ == "__main__":
+    args = vars(parseargs())
+    with profiling.profile_run(args["output_dir"], "multires_flow", args.pop("profile")):
+        calculate_multires_flow(**args)
@@ -1,19 +1,21 @@
-import numpy as np
 import os
 import argparse
 from tqdm import tqdm
 import textwrap
-from src.video import get_video_info
-from src.frame_generator import FrameGeneratorVideo, FrameGeneratorImageSequence
-from src.grid_optical_flow import get_grid_flow, get_grid_centres
+from src.video import get_video_info, AsyncVideoWriter
+from src.frame_generator import FrameGeneratorVideo, FrameGeneratorImageSequence, PrefetchFrameGenerator, \
+    snap_resolution
+from src.grid_optical_flow import GridFlowTracker, TRACKER_MODES
+from src.pipeline import draw_flow, OUTPUT_FRAME_SIZE
+from src.parallel_flow import iter_grid_flow_parallel
+from src.flow_store import FlowStoreWriter
+from src.flow_cache import FlowCache, get_flow_key
+from src import profiling
 import logging
 import cv2
-import pickle
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
 
-OUTPUT_FRAME_SIZE = (400, 400)
-
 
 def parseargs():
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
@@ -31,54 +33,158 @@ def parseargs():
     )
     parser.add_argument("--video_type", type=str, default="video", choices=["video", "image_sequence"],
                         help="Folder where the segmentation and plots are saved")
+    parser.add_argument("--flow-mode", type=str, default="block", choices=TRACKER_MODES,
+                        help="block: track features in each grid block separately.\n"
+                             "batched: detect and track the features of all grid blocks at once.\n"
+                             "dense: average a dense DIS optical flow, computed on a downscaled frame, over each grid block.\n"
+                             "adaptive: like block but only in the grid blocks which changed, the others get zero flow.\n"
+                             "tracked: keep tracking the features of the previous frame pair,\n"
+                             "re-detect features only in depleted cells.")
+    parser.add_argument("--working-resolution", nargs=2, type=int, default=None,
+                        help="Width and height the frames are resized to before computing the optical flow.\n"
+                             "The resolution is shrunk to be divisible by the grid.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes computing the optical flow of a video in parallel.")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Number of frames decoded ahead and queued for encoding on background threads.\n"
+                             "0 decodes and encodes on the main thread.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the optical flow file in the output folder after its last checkpoint.\n"
+                             "If it belongs to another video, the flow of this video is appended to it.")
+    parser.add_argument("--checkpoint-interval", type=int, default=1000,
+                        help="Number of frames after which the optical flow file is flushed to disk.")
+    parser.add_argument("--no-render", dest="render", action="store_false",
+                        help="Do not render the preview video, only compute the data.")
+    parser.add_argument("--preview-stride", type=int, default=1,
+                        help="Render only every k-th frame into the preview video, which then plays k times faster.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Look up and store the optical flow in the flow cache.\n"
+                             "The cache folder is $EGOVIDEO_CACHE_DIR or ~/.cache/egovideo-motion-segmentation.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save the time spent in each processing stage and the peak memory usage\n"
+                             "to <name>_profile.json and <name>_profile.csv in the output folder.")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="Also run under cProfile and dump the statistics to <name>.prof in the output folder.")
 
     args = parser.parse_args()
     return args
 
 
-def calculate_optical_flow(video,video_type, grid_size, output_dir):
-
-    if video_type == "video":
-        fg = FrameGeneratorVideo(video, show_video_info=True, use_rgb=False)
-    elif video_type == "image_sequence":
-        fg = FrameGeneratorImageSequence(video, use_rgb=False)
+def calculate_optical_flow(video,video_type, grid_size, output_dir, flow_mode="block", workers=1, queue_size=8,
+                           working_resolution=None, resume=False, checkpoint_interval=1000, cache=False, render=True,
+                           preview_stride=1):
+    flow_file = os.path.join(output_dir, "optical_flow.npy")
+    parallel = workers > 1 and video_type == "video"
+    flow_cache, key = None, None
+    if cache:
+        flow_cache = FlowCache()
+        key = get_flow_key(video, grid_size, flow_mode, working_resolution, workers=workers if parallel else 1,
+                           chunk_size=checkpoint_interval or None)
+    if flow_cache is not None and not resume and flow_cache.fetch(key, flow_file, source=video):
+        logging.info("Optical flow of {0} loaded from the flow cache".format(video))
+        return
 
-    # get the first frame
-    frame_iterator = iter(fg)
-    p_frame = next(frame_iterator)
-    p_frame = cv2.cvtColor(p_frame, cv2.COLOR_BGR2GRAY)
+    if parallel:
+        # The workers open the video themselves, only its properties are needed here.
+        _, frame_count, fps, _, height, width = get_video_info(video)
+        resolution = snap_resolution((width, height) if working_resolution is None else working_resolution,
+                                     grid_size)
+        every_nth_frame = 1
+    else:
+        if workers > 1:
+            logging.warning("Multiple workers are only supported for video files, running on a single process.")
+        if video_type == "video":
+            fg = FrameGeneratorVideo(video, show_video_info=True, working_resolution=working_resolution,
+                                     grid_size=grid_size, grayscale=True)
+        elif video_type == "image_sequence":
+            fg = FrameGeneratorImageSequence(video, working_resolution=working_resolution,
+                                             grid_size=grid_size, grayscale=True)
+        frame_count, resolution, every_nth_frame = len(fg), fg.resolution, fg.every_nth_frame
+        fps = getattr(fg, "fps", None)
 
-    # The optical flow belonging to the 1st frame is 0 in its magnitude.
-    optical_flow_data = [[],[]]
+    store = FlowStoreWriter(flow_file, frame_count, grid_size[0], grid_size[1],
+                            append=resume, checkpoint_interval=checkpoint_interval,
+                            resolution=list(resolution), fps=fps, stride=every_nth_frame)
+    start_frame = _get_start_frame(store, video)
+    store.metadata["source"] = video
+    store.metadata["complete"] = False
 
     logging.info("Calculation optical flow".format(video))
 
-    out_video_file = os.path.join(output_dir, "optical_flow.mp4")
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    writer = cv2.VideoWriter(out_video_file, fourcc, 25.0, OUTPUT_FRAME_SIZE)
-
-    for frame in tqdm(frame_iterator, desc="playing video", unit="frame", total=len(fg) - 1):
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        origins, displacements = get_grid_flow(p_frame, gray_frame, grid_size[0], grid_size[1])
-        optical_flow_data[0].append(origins)
-        optical_flow_data[1].append(displacements)
-        p_frame = gray_frame
-        if output_dir is not None:
-            out_frame = np.array(frame)
-            for v0, v1 in zip(np.reshape(origins, (-1, 2)), np.reshape(displacements, (-1, 2))):
-                out_frame = cv2.line(out_frame, tuple(v0), tuple(v1), (0, 255, 0), thickness=5)
-                out_frame = cv2.circle(out_frame, tuple(v0), 5, (0, 0, 255),-1)
-            out_frame = cv2.resize(out_frame, OUTPUT_FRAME_SIZE)
-            writer.write(out_frame)
-    optical_flow_data[0].insert(0, optical_flow_data[0][0])
-    optical_flow_data[1].insert(0, optical_flow_data[1][0])
-    optical_flow_data = np.array(optical_flow_data)
-    writer.release()
-    with open(os.path.join(output_dir, "optical_flow.npy"), 'wb') as handle:
-        pickle.dump(optical_flow_data, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    if parallel:
+        logging.info("The flow video is not rendered when running with multiple workers.")
+        # The chunks are about a checkpoint long, so the flow is checkpointed while the workers are running.
+        flow = iter_grid_flow_parallel(video, grid_size, workers, mode=flow_mode,
+                                       working_resolution=working_resolution, start_frame=start_frame,
+                                       chunk_size=checkpoint_interval or None)
+    else:
+        if start_frame > 0:
+            fg.seek(start_frame)
+        if queue_size > 0:
+            fg = PrefetchFrameGenerator(fg, depth=queue_size)
+        flow = _iter_optical_flow(fg, grid_size, output_dir, flow_mode, queue_size,
+                                  len(fg) - start_frame // every_nth_frame, render, preview_stride)
+
+    try:
+        for i, (origins, displacements) in enumerate(flow):
+            # The optical flow belonging to the 1st frame is the same as the one of the 2nd frame.
+            if i == 0 and start_frame == 0:
+                store.append(origins, displacements, source_frame=0)
+            store.append(origins, displacements, source_frame=start_frame + (i + 1) * every_nth_frame)
+        store.metadata["complete"] = True
+    finally:
+        # Everything computed so far is kept, the computation can be continued with --resume.
+        store.close()
+    if flow_cache is not None and "previous_sources" not in store.metadata:
+        flow_cache.put(key, flow_file)
     logging.info("Optical flow computation Done!")
 
 
+def _get_start_frame(store, video):
+    """ Returns the index of the frame of the video the flow computation continues from.
+
+    The flow of a resumed store continues after its last frame if the store belongs to the
+    video, otherwise the flow of the video is appended to it starting from its first frame.
+    """
+    if len(store) == 0:
+        return 0
+    if store.metadata.get("source") != video:
+        logging.info("Appending the optical flow of {0} to the flow of {1}".format(video, store.metadata.get("source")))
+        store.metadata.setdefault("previous_sources", []).append(
+            {"source": store.metadata.get("source"), "frames": len(store)})
+        return 0
+    last_frame = store.metadata.get("last_frame", (len(store) - 1) * store.metadata.get("stride", 1))
+    logging.info("Resuming the optical flow computation after frame {0}".format(last_frame))
+    return last_frame
+
+
+def _iter_optical_flow(fg, grid_size, output_dir, flow_mode, queue_size, total, render=True, preview_stride=1):
+    # get the first frame
+    frame_iterator = iter(fg)
+    p_frame = next(frame_iterator, None)
+    if p_frame is None:
+        return
+    tracker = GridFlowTracker(grid_size[0], grid_size[1], mode=flow_mode)
+    tracker.update(p_frame)
+
+    writer = None
+    if render and output_dir is not None:
+        # The flow is drawn on the background thread of the writer.
+        out_video_file = os.path.join(output_dir, "optical_flow.mp4")
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        writer = AsyncVideoWriter(out_video_file, fourcc, 25.0, OUTPUT_FRAME_SIZE, queue_size=queue_size,
+                                  render=draw_flow)
+
+    for i, frame in enumerate(tqdm(frame_iterator, desc="playing video", unit="frame", total=total - 1)):
+        origins, displacements = tracker.update(frame)
+        yield origins, displacements
+        if writer is not None and i % preview_stride == 0:
+            writer.write((frame, origins, displacements))
+    if writer is not None:
+        writer.release()
+
+
 if __name__ == "__main__":
-    args = parseargs()
-    calculate_optical_flow(**args.__dict__)
+    args = vars(parseargs())
+    with profiling.profile_run(args["output_dir"], "optical_flow", args.pop("profile"), args.pop("cprofile")):
+        calculate_optical_flow(**args)
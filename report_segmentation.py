@@ -19,21 +19,23 @@ def render_report(segmentation_file, output_dir):
     segmentation = pickle.load(open(segmentation_file, "rb"))
     segmentation['Length'] = segmentation.apply(lambda x: x['End frame'] - x['Start frame'], axis=1)
 
-    gpd_segmentation = segmentation.groupby("Type")
-
-    df = pd.DataFrame(data={"Longest stationary segment length": gpd_segmentation.max()["Length"]["visit"],
-                                "Shortest stationary segment length": gpd_segmentation.min()["Length"]["visit"],
-                                "Average stationary segment length": gpd_segmentation.mean()["Length"]["visit"],
-                                "Longest moving segment length": gpd_segmentation.max()["Length"]["transition"],
-                                "Shortest moving segment length": gpd_segmentation.min()["Length"]["transition"],
-                                "Average moving segment length":gpd_segmentation.mean()["Length"]["transition"],
+    # Types without segments get NaN statistics.
+    gpd_segmentation = segmentation.groupby("Type")["Length"].agg(["max", "min", "mean"]).reindex(
+        ["visit", "transition"])
+
+    df = pd.DataFrame(data={"Longest stationary segment length": gpd_segmentation["max"]["visit"],
+                                "Shortest stationary segment length": gpd_segmentation["min"]["visit"],
+                                "Average stationary segment length": gpd_segmentation["mean"]["visit"],
+                                "Longest moving segment length": gpd_segmentation["max"]["transition"],
+                                "Shortest moving segment length": gpd_segmentation["min"]["transition"],
+                                "Average moving segment length":gpd_segmentation["mean"]["transition"],
                                 }, index=[0])
 
     df.to_csv(os.path.join(output_dir, "segmentation_stat.csv"))
     x = [[0]*l if t == "visit" else [1]*l for l, t in zip(segmentation['Length'], segmentation['Type'])]
     x = [x2 for x1 in x for x2 in x1]
     df = pd.DataFrame(data={"x": x, "y": range(len(x))})
-    visualize.plot(df, "y", "x", save_to= output_dir+"segmentation.svg")
+    visualize.plot(df, "y", "x", save_to=os.path.join(output_dir, "segmentation.svg"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,232 @@
+import argparse
+import json
+import logging
+import os
+import textwrap
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from calculate_optica_flow import calculate_optical_flow
+from report_segmentation import render_report
+from run_segmentation import do_segmentation
+from src.flow_store import get_metadata_file
+from src.grid_optical_flow import TRACKER_MODES
+from src.video import get_video_info
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".mpg", ".mpeg", ".wmv", ".m4v")
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                     description=textwrap.dedent(
+                                         '''compute the optical flow, the segmentation and the report of many videos'''))
+    parser.add_argument('--videos', '-v', type=str,
+                        help="a folder of videos (or of image sequence folders) or a manifest file\n"
+                             "listing one video per line, relative to the manifest")
+    parser.add_argument("--video_type", type=str, default="video", choices=["video", "image_sequence"],
+                        help="Type of the video sources")
+    parser.add_argument("--output-dir", "-o", type=str,
+                        help="Folder where the output folder of each video and the summary are saved")
+    parser.add_argument(
+        "--grid-size",
+        "-g",
+        nargs="+",
+        type=int,
+        help="A touple representing the nrows and ncols of the grid.",
+    )
+    parser.add_argument("--flow-mode", type=str, default="block", choices=TRACKER_MODES,
+                        help="Optical flow mode, see calculate_optica_flow.py")
+    parser.add_argument("--working-resolution", nargs=2, type=int, default=None,
+                        help="Width and height the frames are resized to before computing the optical flow.")
+    parser.add_argument('--transition-threshold', type=float, help="The threshold parameter for visit segmentation")
+    parser.add_argument('--motion-threshold', type=float, help="The threshold parameter for view segmentation")
+    parser.add_argument('--min_view_section_length', type=float, default=25,
+                        help="The minimum number of frames a view has to contain")
+    parser.add_argument('--min_visit_section_length', type=float, default=75,
+                        help="The minimum number of frames a visit has to contain")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(),
+                        help="Number of videos processed in parallel.")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Number of frames decoded ahead and queued for encoding on background threads.")
+    parser.add_argument("--no-render", dest="render", action="store_false",
+                        help="Do not render the preview videos, only compute the data and the reports.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Look up and store the optical flow in the flow cache, see calculate_optica_flow.py.")
+
+    args = parser.parse_args()
+    return args
+
+
+def list_videos(videos, video_type="video"):
+    """ Returns the paths of the videos of a folder or of a manifest file.
+
+    Parameters
+    ----------
+    videos: str
+        a folder of video files, a folder of image sequence folders if video_type is "image_sequence",
+        or a text file listing one path per line. Relative paths of a manifest are relative to its folder.
+    video_type: str, Optional
+        "video" or "image_sequence"
+
+    Returns
+    -------
+        a sorted list of paths
+    """
+    if os.path.isdir(videos):
+        paths = [os.path.join(videos, f) for f in os.listdir(videos)]
+        if video_type == "image_sequence":
+            return sorted(p for p in paths if os.path.isdir(p))
+        return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(VIDEO_EXTENSIONS))
+
+    with open(videos, "r") as handle:
+        lines = [line.strip() for line in handle]
+    return [os.path.join(os.path.dirname(videos), line) for line in lines if line and not line.startswith("#")]
+
+
+def get_frame_count(video, video_type="video"):
+    """ Returns the number of frames of a video or of an image sequence."""
+    if video_type == "image_sequence":
+        return len([f for f in os.listdir(video) if os.path.isfile(os.path.join(video, f))])
+    _, frame_count, _, _, _, _ = get_video_info(video)
+    return frame_count
+
+
+def get_video_output_dirs(output_dir, videos):
+    """ Returns the output folder of each video.
+
+    The output folder of a video is its path relative to the common folder of all the videos,
+    without the extension. So the videos of a folder get the folders named after them and the
+    videos of a manifest from different folders keep their folder structure.
+
+    Raises
+    ------
+        ValueError: if two videos would be written into the same output folder, e.g. a.mp4 and a.avi.
+
+    Returns
+    -------
+        a dictionary mapping each video to its output folder
+    """
+    if not videos:
+        return {}
+    paths = [os.path.abspath(video) for video in videos]
+    root = os.path.commonpath(paths)
+    if len(paths) == 1 or os.path.isfile(root):
+        root = os.path.dirname(root)
+    video_output_dirs = {}
+    shared = {}
+    for video, path in zip(videos, paths):
+        video_output_dirs[video] = os.path.join(output_dir, os.path.splitext(os.path.relpath(path, root))[0])
+        shared.setdefault(os.path.normcase(video_output_dirs[video]), []).append(video)
+    shared = [videos for videos in shared.values() if len(videos) > 1]
+    if shared:
+        raise ValueError("These videos would share an output folder: {0}".format(
+            "; ".join(", ".join(videos) for videos in shared)))
+    return video_output_dirs
+
+
+def _segment_stats(df, name):
+    lengths = df["End frame"] - df["Start frame"]
+    return {"{} segments".format(name): len(lengths),
+            "Average {} segment length".format(name): lengths.mean() if len(lengths) else float("nan")}
+
+
+def process_video(video, video_type, video_output_dir, grid_size, transition_threshold, motion_threshold,
+                  min_view_section_length, min_visit_section_length, flow_mode="block", working_resolution=None,
+                  queue_size=8, render=True, cache=False):
+    """ Compute the optical flow, the segmentation and the report of a video in its own output folder,
+    see get_video_output_dirs.
+
+    Steps whose outputs exist are skipped, an interrupted optical flow computation is resumed.
+    The summary of a finished video is saved in summary.json of its output folder.
+
+    Returns
+    -------
+        the summary dictionary of the video
+    """
+    summary_file = os.path.join(video_output_dir, "summary.json")
+    if os.path.isfile(summary_file):
+        with open(summary_file, "r") as handle:
+            return json.load(handle)
+    os.makedirs(video_output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    flow_file = os.path.join(video_output_dir, "optical_flow.npy")
+    metadata = {}
+    if os.path.isfile(get_metadata_file(flow_file)):
+        with open(get_metadata_file(flow_file), "r") as handle:
+            metadata = json.load(handle)
+    if not metadata.get("complete", False):
+        calculate_optical_flow(video, video_type, grid_size, video_output_dir, flow_mode=flow_mode,
+                               queue_size=queue_size, working_resolution=working_resolution, resume=bool(metadata),
+                               render=render, cache=cache)
+
+    view_file = os.path.join(video_output_dir, "view_segmentation.pickle")
+    visit_file = os.path.join(video_output_dir, "visit_segmentation.pickle")
+    if not (os.path.isfile(view_file) and os.path.isfile(visit_file)):
+        do_segmentation(video, video_type, flow_file, transition_threshold, motion_threshold,
+                        min_view_section_length, min_visit_section_length, video_output_dir, queue_size=queue_size,
+                        render=render)
+
+    if not os.path.isfile(os.path.join(video_output_dir, "segmentation_stat.csv")):
+        render_report(visit_file, video_output_dir)
+
+    view_df = pd.read_pickle(view_file)
+    visit_df = pd.read_pickle(visit_file)
+    summary = {"Video": video, "Output dir": video_output_dir, "Frames": get_frame_count(video, video_type)}
+    summary.update(_segment_stats(view_df, "View"))
+    summary.update(_segment_stats(visit_df[visit_df["Type"] == "visit"], "Visit"))
+    summary.update(_segment_stats(visit_df[visit_df["Type"] == "transition"], "Transition"))
+    summary["Processing time"] = time.perf_counter() - start
+    with open(summary_file, "w") as handle:
+        json.dump(summary, handle, indent=2)
+    return summary
+
+
+def run_batch(videos, video_type, output_dir, grid_size, transition_threshold, motion_threshold,
+              min_view_section_length, min_visit_section_length, flow_mode="block", working_resolution=None,
+              jobs=1, queue_size=8, render=True, cache=False):
+    video_files = list_videos(videos, video_type)
+    video_output_dirs = get_video_output_dirs(output_dir, video_files)
+    frame_counts = {}
+    for video in video_files:
+        try:
+            frame_counts[video] = get_frame_count(video, video_type)
+        except ValueError as e:
+            # The job of the video fails and is reported in the summary.
+            logging.warning(e)
+            frame_counts[video] = 0
+    # Longest jobs first, so a long video started last does not keep the pool waiting.
+    video_files.sort(key=lambda video: frame_counts[video], reverse=True)
+    logging.info("Processing {0} videos with {1} jobs".format(len(video_files), jobs))
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(process_video, video, video_type, video_output_dirs[video], grid_size,
+                                   transition_threshold, motion_threshold, min_view_section_length,
+                                   min_visit_section_length,
+                                   flow_mode=flow_mode, working_resolution=working_resolution,
+                                   queue_size=queue_size, render=render, cache=cache): video
+                   for video in video_files}
+        for future in as_completed(futures):
+            video = futures[future]
+            try:
+                rows.append(dict(future.result(), Status="done"))
+                logging.info("Finished {0}".format(video))
+            except Exception as e:
+                logging.error("Processing {0} failed: {1!r}".format(video, e))
+                rows.append({"Video": video, "Frames": frame_counts[video], "Status": "failed: {0!r}".format(e)})
+
+    order = {video: i for i, video in enumerate(sorted(video_files))}
+    df = pd.DataFrame(sorted(rows, key=lambda row: order[row["Video"]]))
+    df.to_csv(os.path.join(output_dir, "batch_summary.csv"), index=False)
+    logging.info("Batch Done!")
+    return df
+
+
+if __name__ == "__main__":
+    args = parseargs()
+    run_batch(**args.__dict__)
@@ -0,0 +1,105 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+import textwrap
+
+from src import profiling
+from src.frame_generator import FrameGeneratorStream
+from src.grid_optical_flow import TRACKER_MODES
+from src.live import LiveSegmenter, get_boundary_events
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                     description=textwrap.dedent(
+                                         '''segment a camera feed or a stream live, the segment boundaries are
+                                         written as JSON lines as they are detected'''))
+    parser.add_argument('--source', '-s', type=str, default="0",
+                        help="index of a camera device, url of a stream or path of a video file")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Capture the frames at the pace of the fps of the source,\n"
+                             "e.g. to play a video file back like a camera.")
+    parser.add_argument(
+        "--grid-size",
+        "-g",
+        nargs="+",
+        type=int,
+        help="A touple representing the nrows and ncols of the grid.",
+    )
+    parser.add_argument("--flow-mode", type=str, default="block", choices=TRACKER_MODES,
+                        help="Optical flow mode, see calculate_optica_flow.py")
+    parser.add_argument("--working-resolution", nargs=2, type=int, default=None,
+                        help="Width and height the frames are resized to before computing the optical flow.\n"
+                             "The resolution is shrunk to be divisible by the grid.")
+    parser.add_argument('--transition-threshold', type=float, help="The threshold parameter for visit segmentation")
+    parser.add_argument('--motion-threshold', type=float, help="The threshold parameter for view segmentation")
+    parser.add_argument("--latency-budget", type=float, default=200,
+                        help="Frames older than this many milliseconds when their processing would start\n"
+                             "are dropped.")
+    parser.add_argument("--buffer-size", type=int, default=1,
+                        help="Number of captured frames waiting for processing, the oldest is dropped\n"
+                             "when the buffer is full.")
+    parser.add_argument("--events", type=str, default="-",
+                        help="File the segment boundary events are written to as JSON lines, - for stdout.")
+    parser.add_argument("--latency-log", type=str, default=None,
+                        help="CSV file the segmentation and the latency of every processed frame is written to.")
+    parser.add_argument("--stats-file", type=str, default=None,
+                        help="JSON file the frame and latency statistics are saved to at the end.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save the time spent in each processing stage and the peak memory usage\n"
+                             "to live_profile.json and live_profile.csv in the current folder.")
+
+    args = parser.parse_args()
+    return args
+
+
+def run_live(source, grid_size, transition_threshold, motion_threshold, flow_mode="block", working_resolution=None,
+             realtime=False, latency_budget=200, buffer_size=1, events="-", latency_log=None, stats_file=None):
+    # The stream info would mix with the events on stdout.
+    fg = FrameGeneratorStream(int(source) if source.isdigit() else source, show_video_info=events != "-",
+                              grayscale=True, working_resolution=working_resolution, grid_size=grid_size,
+                              realtime=realtime, buffer_size=buffer_size)
+    segmenter = LiveSegmenter(fg, grid_size, transition_threshold, motion_threshold, flow_mode=flow_mode,
+                              latency_budget=latency_budget / 1000)
+
+    events_handle = sys.stdout if events == "-" else open(events, "w")
+    log_handle = None if latency_log is None else open(latency_log, "w", newline="")
+    log_writer = None
+    previous = None
+    try:
+        for record in segmenter:
+            for event in get_boundary_events(record, previous):
+                events_handle.write(json.dumps(event) + "\n")
+                events_handle.flush()
+            if log_handle is not None:
+                if log_writer is None:
+                    log_writer = csv.DictWriter(log_handle, fieldnames=list(record))
+                    log_writer.writeheader()
+                log_writer.writerow(record)
+            previous = record
+    except KeyboardInterrupt:
+        logging.info("Stopped")
+    finally:
+        if events_handle is not sys.stdout:
+            events_handle.close()
+        if log_handle is not None:
+            log_handle.close()
+
+    stats = segmenter.stats()
+    logging.info("Processed {frames_processed} of {frames_captured} frames at {processed_fps:.1f} fps, "
+                 "latency p50 {latency_p50_ms:.1f}ms, p95 {latency_p95_ms:.1f}ms, "
+                 "max {latency_max_ms:.1f}ms".format(**stats))
+    if stats_file is not None:
+        with open(stats_file, "w") as handle:
+            json.dump(stats, handle, indent=2)
+    return stats
+
+
+if __name__ == "__main__":
+    args = vars(parseargs())
+    with profiling.profile_run(".", "live", args.pop("profile")):
+        run_live(**args)
@@ -0,0 +1,136 @@
+import argparse
+import logging
+import os
+import textwrap
+
+import cv2
+from tqdm import tqdm
+
+from src import profiling
+from src.flow_cache import FlowCache, get_flow_key
+from src.flow_store import FlowStoreWriter, load_flow
+from src.frame_generator import FrameGeneratorVideo, FrameGeneratorImageSequence, PrefetchFrameGenerator
+from src.grid_optical_flow import TRACKER_MODES
+from src.pipeline import grayscale_stage, grid_flow_stage, flow_store_stage, segmentation_stage, annotate_frame, \
+    OUTPUT_FRAME_SIZE
+from src.video import AsyncVideoWriter
+from src.utils import view_sparse_segmentation_to_df, visit_sparse_segmentation_to_df
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                     description=textwrap.dedent(
+                                         '''compute optical flow and segment a video in a single pass'''))
+    parser.add_argument('--video', '-v', type=str, help="path to the videofile")
+    parser.add_argument("--video_type", type=str, default="video", choices=["video", "image_sequence"],
+                        help="Type of the video source")
+    parser.add_argument(
+        "--grid-size",
+        "-g",
+        nargs="+",
+        type=int,
+        help="A touple representing the nrows and ncols of the grid.",
+    )
+    parser.add_argument("--flow-mode", type=str, default="block", choices=TRACKER_MODES,
+                        help="Optical flow mode, see calculate_optica_flow.py")
+    parser.add_argument("--working-resolution", nargs=2, type=int, default=None,
+                        help="Width and height the frames are resized to before computing the optical flow.\n"
+                             "The resolution is shrunk to be divisible by the grid.")
+    parser.add_argument('--transition-threshold', type=float, help="The threshold parameter for visit segmentation")
+    parser.add_argument('--motion-threshold', type=float, help="The threshold parameter for view segmentation")
+    parser.add_argument('--min_view_section_length', type=float, default=25,
+                        help="The minimum number of frames a view has to contain")
+    parser.add_argument('--min_visit_section_length', type=float, default=75,
+                        help="The minimum number of frames a visit has to contain")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Number of frames decoded ahead and queued for encoding on background threads.\n"
+                             "0 decodes and encodes on the main thread.")
+    parser.add_argument("--output-dir", "-o", type=str,
+                        help="Folder where the optical flow, the segmentation and the videos are saved")
+    parser.add_argument("--no-render", dest="render", action="store_false",
+                        help="Do not render the preview video, only compute the data.")
+    parser.add_argument("--preview-stride", type=int, default=1,
+                        help="Render only every k-th frame into the preview video, which then plays k times faster.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Look up and store the optical flow in the flow cache, see calculate_optica_flow.py.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save the time spent in each processing stage and the peak memory usage\n"
+                             "to <name>_profile.json and <name>_profile.csv in the output folder.")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="Also run under cProfile and dump the statistics to <name>.prof in the output folder.")
+
+    args = parser.parse_args()
+    return args
+
+
+def run_pipeline(video, video_type, grid_size, transition_threshold, motion_threshold, min_view_section_length,
+                 min_visit_section_length, output_dir, flow_mode="block", queue_size=8, working_resolution=None,
+                 cache=False, render=True, preview_stride=1):
+    # Without rendering only the grayscale frames are needed.
+    if video_type == "video":
+        fg = FrameGeneratorVideo(video, show_video_info=True, use_rgb=False, working_resolution=working_resolution,
+                                 grid_size=grid_size, grayscale=not render)
+    elif video_type == "image_sequence":
+        fg = FrameGeneratorImageSequence(video, use_rgb=False, working_resolution=working_resolution,
+                                         grid_size=grid_size, grayscale=not render)
+    if queue_size > 0:
+        fg = PrefetchFrameGenerator(fg, depth=queue_size)
+
+    flow_file = os.path.join(output_dir, "optical_flow.npy")
+    flow_cache, key, store = None, None, None
+    if cache:
+        flow_cache = FlowCache()
+        key = get_flow_key(video, grid_size, flow_mode, working_resolution, color_frames=render)
+
+    if flow_cache is not None and flow_cache.fetch(key, flow_file, source=video):
+        logging.info("Optical flow of {0} loaded from the flow cache".format(video))
+        origins, vectors, _ = load_flow(flow_file)
+        if render:
+            items = ((frame, origins, origins + frame_vectors) for frame, frame_vectors in zip(fg, vectors))
+        else:
+            items = ((None, origins, origins + frame_vectors) for frame_vectors in vectors)
+    else:
+        store = FlowStoreWriter(flow_file, len(fg), grid_size[0], grid_size[1],
+                                source=video, resolution=list(fg.resolution), fps=getattr(fg, "fps", None),
+                                stride=fg.every_nth_frame)
+        items = grayscale_stage(fg) if render else ((frame, frame) for frame in fg)
+        items = grid_flow_stage(items, grid_size[0], grid_size[1], mode=flow_mode)
+        items = flow_store_stage(items, store)
+
+    writer = None
+    if render:
+        # The labels are drawn on the background thread of the writer.
+        out_video_file = os.path.join(output_dir, "segmented.mp4")
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        writer = AsyncVideoWriter(out_video_file, fourcc, 25.0, OUTPUT_FRAME_SIZE, queue_size=queue_size,
+                                  render=annotate_frame)
+
+    items = segmentation_stage(items, transition_threshold, motion_threshold)
+
+    visit_segmentation = []
+    view_segmentation = []
+    for i, (frame, is_visit, view_count) in enumerate(tqdm(items, desc="Segmenting", total=len(fg), unit="frame")):
+        visit_segmentation.append(is_visit)
+        view_segmentation.append(view_count)
+        if writer is not None and i % preview_stride == 0:
+            writer.write((frame, is_visit, view_count))
+    if writer is not None:
+        writer.release()
+    if store is not None:
+        store.close()
+        if flow_cache is not None:
+            flow_cache.put(key, flow_file)
+
+    view_segmentation_df = view_sparse_segmentation_to_df(view_segmentation, min_view_section_length)
+    visit_segmentation_df = visit_sparse_segmentation_to_df(visit_segmentation, min_visit_section_length)
+    view_segmentation_df.to_pickle(os.path.join(output_dir, "view_segmentation.pickle"))
+    visit_segmentation_df.to_pickle(os.path.join(output_dir, "visit_segmentation.pickle"))
+    logging.info("Segmentation Done!")
+
+
+if __name__ == "__main__":
+    args = vars(parseargs())
+    with profiling.profile_run(args["output_dir"], "pipeline", args.pop("profile"), args.pop("cprofile")):
+        run_pipeline(**args)
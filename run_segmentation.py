@@ -1,19 +1,20 @@
 import argparse
 import logging
 import os
-import pickle
 import textwrap
 
 import cv2
 from tqdm import tqdm
 
-from src.frame_generator import FrameGeneratorVideo, FrameGeneratorImageSequence
-from src.segmnet import segment_view, segment_visit
+from src import profiling
+from src.flow_store import load_flow
+from src.frame_generator import FrameGeneratorVideo, FrameGeneratorImageSequence, PrefetchFrameGenerator
+from src.pipeline import annotate_frame, OUTPUT_FRAME_SIZE
+from src.segmnet import segment_view_vectors, segment_visit_vectors, count_view_segments
 from src.utils import view_sparse_segmentation_to_df, visit_sparse_segmentation_to_df
-from src.video import get_video_info
+from src.video import get_video_info, AsyncVideoWriter
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
-OUTPUT_FRAME_SIZE = (400, 400)
 
 
 def parseargs():
@@ -28,60 +29,72 @@ def parseargs():
                         help="The minimum number of frames a view has to contain")
     parser.add_argument('--min_visit_section_length', type=float, default=75,
                         help="The minimum number of frames a visit has to contain")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Number of frames decoded ahead and queued for encoding on background threads.\n"
+                             "0 decodes and encodes on the main thread.")
+    parser.add_argument("--no-render", dest="render", action="store_false",
+                        help="Do not render the preview video, only compute the data.")
+    parser.add_argument("--preview-stride", type=int, default=1,
+                        help="Render only every k-th frame into the preview video, which then plays k times faster.")
     parser.add_argument("--output-dir", "-o", type=str,
                         help="Folder where the segmentation and plots are saved")
     parser.add_argument("--video_type", type=str, default="video", choices=["video", "image_sequence"],
                         help="Folder where the segmentation and plots are saved")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save the time spent in each processing stage and the peak memory usage\n"
+                             "to <name>_profile.json and <name>_profile.csv in the output folder.")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="Also run under cProfile and dump the statistics to <name>.prof in the output folder.")
 
     args = parser.parse_args()
     return args
 
 
 def do_segmentation(video_file, video_type, optical_flow_file, transition_threshold, motion_threshold, min_view_section_length,
-                    min_visit_section_length, output_dir
+                    min_visit_section_length, output_dir, queue_size=8, render=True, preview_stride=1
                     ):
-    with open(optical_flow_file, 'rb') as handle:
-        optical_flow = pickle.load(handle)
+    origins, vectors, _ = load_flow(optical_flow_file)
 
+    with profiling.stage("segmentation"):
+        visit_segmentation = segment_visit_vectors(origins, vectors, transition_threshold)
+        view_segmentation = count_view_segments(visit_segmentation,
+                                                segment_view_vectors(vectors, motion_threshold))
+
+    if render:
+        _render_segmentation(video_file, video_type, visit_segmentation, view_segmentation, output_dir, queue_size,
+                             preview_stride)
+    view_segmentation_df = view_sparse_segmentation_to_df(view_segmentation, min_view_section_length)
+    visit_segmentation_df = visit_sparse_segmentation_to_df(visit_segmentation, min_visit_section_length)
+    view_segmentation_df.to_pickle(os.path.join(output_dir, "view_segmentation.pickle"))
+    visit_segmentation_df.to_pickle(os.path.join(output_dir, "visit_segmentation.pickle"))
+
+
+def _render_segmentation(video_file, video_type, visit_segmentation, view_segmentation, output_dir, queue_size,
+                         preview_stride):
+    """ Write every preview_stride-th frame of the video with its segmentation labels to segmented.mp4."""
     if video_type == "video":
-        fg = FrameGeneratorVideo(video_file, show_video_info=True, use_rgb=False)
+        fg = FrameGeneratorVideo(video_file, show_video_info=True, use_rgb=False, working_resolution=OUTPUT_FRAME_SIZE,
+                                 every_nth_frame=preview_stride)
     elif video_type == "image_sequence":
-        fg = FrameGeneratorImageSequence(video_file, use_rgb=False)
+        fg = FrameGeneratorImageSequence(video_file, use_rgb=False, working_resolution=OUTPUT_FRAME_SIZE,
+                                         every_nth_frame=preview_stride)
+    if queue_size > 0:
+        fg = PrefetchFrameGenerator(fg, depth=queue_size)
 
+    # The labels are drawn on the background thread of the writer.
     out_video_file = os.path.join(output_dir, "segmented.mp4")
     fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    writer = cv2.VideoWriter(out_video_file, fourcc, 25.0, OUTPUT_FRAME_SIZE)
-
-    frame_cnt = 0
-    visit_segmentation = []
-    view_segmentation = []
-    view_count = 0
-
-    for is_visit, is_new_segment, frame in tqdm(zip(segment_visit(optical_flow, transition_threshold),
-                                                    segment_view(optical_flow, motion_threshold),
-                                                    fg),
-                                                total=len(fg),
-                                                unit="Frame"):
-        frame_cnt += 1
-        visit_segmentation.append(is_visit)
-        view_count += int(is_new_segment)
-        view_count += 0 if len(visit_segmentation) < 2 else int(visit_segmentation[-2] != visit_segmentation[-1])
-        view_segmentation.append(view_count)
-
-        transition_text = "In visit:{}".format(str(is_visit))
-        motion_segment_text = "sgmt:{}".format(str(view_count))
-        frame = cv2.resize(frame, OUTPUT_FRAME_SIZE)
-        frame = cv2.putText(frame, transition_text, (0, 20),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, (209, 80, 0, 255), 3)
-        frame = cv2.putText(frame, motion_segment_text, (0, 40),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, (209, 80, 0, 255), 3)
-        writer.write(frame)
+    writer = AsyncVideoWriter(out_video_file, fourcc, 25.0, OUTPUT_FRAME_SIZE, queue_size=queue_size,
+                              render=annotate_frame)
+    for is_visit, view_count, frame in tqdm(zip(visit_segmentation[::preview_stride],
+                                                view_segmentation[::preview_stride], fg),
+                                            total=len(fg),
+                                            unit="Frame"):
+        writer.write((frame, is_visit, view_count))
     writer.release()
-    view_segmentation_df = view_sparse_segmentation_to_df(view_segmentation, min_view_section_length)
-    visit_segmentation_df = visit_sparse_segmentation_to_df(visit_segmentation, min_visit_section_length)
-    view_segmentation_df.to_pickle(os.path.join(output_dir, "view_segmentation.pickle"))
-    visit_segmentation_df.to_pickle(os.path.join(output_dir, "visit_segmentation.pickle"))
+
 
 if __name__ == "__main__":
-    args = parseargs()
-    do_segmentation(**args.__dict__)
+    args = vars(parseargs())
+    with profiling.profile_run(args["output_dir"], "segmentation", args.pop("profile"), args.pop("cprofile")):
+        do_segmentation(**args)
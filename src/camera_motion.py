@@ -1,54 +1,164 @@
-import cv2
 import numpy as np
-import scipy.optimize as optimize
 
 
-def _z_translation_fn(data, parameter, focal_length):
-    x = data[:, :, 0]
-    y = data[:, :, 1]
+def _z_translation_basis(origins, focal_length):
+    """ The optical flow caused by a unit camera transition on the z axis at the given
+    (normalized) origins. The model is linear in the amount of transition so the flow of
+    any transition is this basis multiplied by the amount."""
     f = focal_length
-    new_data = np.array(data)
-    new_data[:, :, 0] = f * (np.arctan(x / f)) * (1 + (x ** 2 / f ** 2)) * parameter
-    new_data[:, :, 1] = f * (np.arctan(y / f)) * (1 + (y ** 2 / f ** 2)) * parameter
+    return f * np.arctan(origins / f) * (1 + (origins ** 2 / f ** 2))
 
-    return new_data.flatten()
+
+def _normalize(origins, displacements):
+    """ Centre and scale the grid origins and the displaced origins.
+
+    Works on a single frame of shape (n_rows, n_cols, 2) and on a batch of frames with shape
+    (frames, n_rows, n_cols, 2) as well, where each frame is normalized by its own origins.
+    """
+    origins = np.array(origins, dtype=np.float64)
+    displacements = np.array(displacements, dtype=np.float64)
+
+    o_max = np.max(origins, axis=(-3, -2), keepdims=True)
+    o_min = np.min(origins, axis=(-3, -2), keepdims=True)
+    c = (o_max - o_min) // 2
+
+    origins -= (c + o_min)
+    origins /= c
+    displacements -= (c - o_min)
+    displacements /= c
+    return origins, displacements
+
+
+class CameraMotionModel:
+    def __init__(self, origins, focal_length=150):
+        """
+        The camera motion model of a grid, built once for the grid origins shared by all frames
+        of a video. The normalized origins and the model basis are computed here, so estimating
+        the motion of a frame is a normalization of its displacements and a dot product.
+
+        Parameters
+        ----------
+        origins: numpy array
+            the grid origins of shape (n_rows, n_cols, 2) in (x, y) pixel coordinates
+        focal_length: float, Optional
+        """
+        self.origins = np.array(origins, dtype=np.float64)
+        self.origins.setflags(write=False)
+        self.focal_length = focal_length
+
+        o_max = np.max(self.origins, axis=(0, 1), keepdims=True)
+        o_min = np.min(self.origins, axis=(0, 1), keepdims=True)
+        c = (o_max - o_min) // 2
+        # The same normalization as _normalize, see estimate_z_transition_batch.
+        self._scale = c
+        self._offset = c - o_min
+        normalized = (self.origins - (c + o_min)) / c
+        basis = _z_translation_basis(normalized, focal_length)
+        self._basis = basis.reshape(-1)
+        self._basis_norm = self._basis @ self._basis
+
+        # The flow in pixels of a unit z transition, x and y pan and rotation around the grid centre
+        # in radians, fitted together to the flow of a frame by least squares.
+        x, y = np.moveaxis(self.origins - (c + o_min), -1, 0)
+        ones, zeros = np.ones_like(x), np.zeros_like(x)
+        motion_basis = np.stack([basis * c,
+                                 np.stack((ones, zeros), axis=-1),
+                                 np.stack((zeros, ones), axis=-1),
+                                 np.stack((-y, x), axis=-1)]).reshape(4, -1)
+        solver = np.linalg.pinv(motion_basis.T)
+
+        # estimate_motion is a single affine map of the displaced origins. Its first column is the
+        # z transition of z_transition, the others are the pan and rotation of the joint fit.
+        scale = np.broadcast_to(c, basis.shape).reshape(-1)
+        offset = np.broadcast_to(self._offset, basis.shape).reshape(-1)
+        z_weights = self._basis / scale / self._basis_norm
+        self._weights = np.column_stack((z_weights, solver[1:].T))
+        self._bias = -self.origins.reshape(-1) @ self._weights
+        self._bias[0] = -offset @ z_weights
+
+    def _flatten(self, displacements):
+        displacements = np.asarray(displacements)
+        return displacements.reshape(-1, self._basis.size), displacements.ndim == 3
+
+    def z_transition(self, displacements):
+        """
+        Estimates the amount of camera transition on the z axis like estimate_z_transition.
+
+        Parameters
+        ----------
+        displacements: numpy array
+            the displaced grid origins of a frame with shape (n_rows, n_cols, 2) or of a batch of
+            frames with shape (frames, n_rows, n_cols, 2)
+
+        Returns
+        -------
+            - The estimated amount of transition, a numpy array of shape (frames,) for a batch.
+        """
+        displacements = np.array(displacements, dtype=np.float64)
+        displacements -= self._offset
+        displacements /= self._scale
+        displacements, single = self._flatten(displacements)
+        z_transitions = displacements @ self._basis / self._basis_norm
+        return z_transitions[0] if single else z_transitions
+
+    def estimate_motion(self, displacements):
+        """
+        Estimates the camera transition on the z axis, the pan and the rotation of the camera.
+
+        Parameters
+        ----------
+        displacements: numpy array
+            the displaced grid origins of a frame with shape (n_rows, n_cols, 2) or of a batch of
+            frames with shape (frames, n_rows, n_cols, 2)
+
+        Returns
+        -------
+            - numpy array of shape (4,), or (frames, 4) for a batch, holding the z transition as
+            z_transition estimates it, the x and y pan of the scene content in pixels and its
+            rotation in radians. The pan and rotation are fitted together with the z transition
+            so the zoom does not leak into them.
+        """
+        displacements, single = self._flatten(displacements)
+        motion = displacements @ self._weights + self._bias
+        return motion[0] if single else motion
 
 
 def estimate_z_transition(origins, displacements, focal_length=150):
     """
     Estimates amount of camera transition on the z axis based on optical flow.
 
+    The flow model is linear in its only parameter so the least squares fit has a
+    closed-form solution.
+
     Returns
     -------
         - The estimated amount of transition on the z axis of the camera.
-        - The perfect optical flow based on the estimation
     """
+    return estimate_z_transition_batch(np.asarray(origins)[None], np.asarray(displacements)[None], focal_length)[0]
 
-    # x = np.linspace(-1.0, 1.0, optical_flow.shape[0])
-    # y = np.linspace(-1.0, 1.0, optical_flow.shape[1])
-    # xv, yv = np.meshgrid(y, x)
-    # origins = np.stack((xv,yv),-1)
-
-    cx = (np.max(origins[:, :, 0]) - np.min(origins[:, :, 0])) // 2
-    cy = (np.max(origins[:, :, 1]) - np.min(origins[:, :, 1])) // 2
-    cx_min = np.min(origins[:, :, 0])
-    cy_min = np.min(origins[:, :, 1])
 
-    origins = np.array(origins, dtype=np.float)
-    origins[:, :, 0] -= (cx+cx_min)
-    origins[:, :, 1] -= (cy+cy_min)
-    origins[:, :, 0] = origins[:, :, 0] / cx
-    origins[:, :, 1] = origins[:, :, 1] / cy
-
-    displacements = np.array(displacements, dtype=np.float)
-    displacements[:, :, 0] -= (cx-cx_min)
-    displacements[:, :, 1] -= (cy-cy_min)
-    displacements[:, :, 0] = displacements[:, :, 0] / cx
-    displacements[:, :, 1] = displacements[:, :, 1] / cy
-
-    func = lambda data, parameter: _z_translation_fn(data, parameter, focal_length)
+def estimate_z_transition_batch(origins, displacements, focal_length=150):
+    """
+    Estimates amount of camera transition on the z axis for a batch of frames at once.
 
-    # abs_optical_flow = optical_flow+origins
+    Parameters
+    ----------
+    origins: numpy array
+        the grid origins of each frame with shape (frames, n_rows, n_cols, 2), or the grid origins
+        shared by all frames with shape (n_rows, n_cols, 2).
+    displacements: numpy array
+        the displaced grid origins of each frame with shape (frames, n_rows, n_cols, 2)
+    focal_length: float, Optional
 
-    param, pcov = optimize.curve_fit(func, origins, displacements.flatten())
-    return param[0]
+    Returns
+    -------
+        - numpy array of shape (frames,) holding the estimated amount of transition on the z
+        axis of the camera for each frame.
+    """
+    if np.ndim(origins) == 3:
+        return CameraMotionModel(origins, focal_length).z_transition(displacements)
+    origins, displacements = _normalize(origins, displacements)
+    basis = _z_translation_basis(origins, focal_length)
+    displacements = displacements.reshape(len(displacements), -1)
+    basis = basis.reshape(len(basis), -1)
+    return np.einsum("ij,ij->i", basis, displacements) / np.einsum("ij,ij->i", basis, basis)
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from os.path import isfile, join
+from src.flow_store import get_metadata_file
+from src.optical_flow import k_params, feature_params, dense_params, adaptive_params
+
+CACHE_DIR = os.environ.get("EGOVIDEO_CACHE_DIR",
+                           join(os.path.expanduser("~"), ".cache", "egovideo-motion-segmentation"))
+CACHE_MAX_SIZE = int(os.environ.get("EGOVIDEO_CACHE_MAX_SIZE", 20 * 1024 ** 3))
+
+# Increase when a change of the flow computation invalidates the cached flow.
+CACHE_VERSION = 3
+
+
+def _source_fingerprint(source, content_hash=False):
+    """ Fingerprint of a video file or of the images of an image sequence folder.
+
+    Parameters
+    ----------
+    source: str
+        path to a video file or to a folder of images
+    content_hash: bool, Optional
+        if True the sha256 of the content of the files is used, otherwise their names,
+        sizes and modification times.
+
+    Returns
+    -------
+        a json serializable fingerprint
+    """
+    if os.path.isdir(source):
+        files = sorted(join(source, f) for f in os.listdir(source) if isfile(join(source, f)))
+    else:
+        files = [source]
+
+    if content_hash:
+        digest = hashlib.sha256()
+        for file in files:
+            with open(file, "rb") as handle:
+                for block in iter(lambda: handle.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    fingerprint = []
+    for file in files:
+        stat = os.stat(file)
+        fingerprint.append([os.path.basename(file), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def get_flow_key(source, grid_size, flow_mode, working_resolution=None, stride=1, workers=1, content_hash=False,
+                 chunk_size=None, color_frames=False):
+    """ Returns the cache key of the grid flow of a video computed with the given parameters.
+
+    Besides the parameters the key covers the optical flow parameters of src.optical_flow,
+    so changing k_params, feature_params, dense_params or adaptive_params invalidates the cached flow.
+
+    Parameters
+    ----------
+    source: str
+        path to a video file or to a folder of images
+    grid_size: Tuple(int)
+        number of rows and columns of the grid
+    flow_mode: str
+        optical flow mode, see src.grid_optical_flow.TRACKER_MODES
+    working_resolution: Tuple(int), Optional
+        (width, height) the frames are resized to.
+    stride: int, Optional
+        every_nth_frame of the frame generator
+    workers: int, Optional
+        number of processes computing the flow, see src.parallel_flow. It is only part of the key in
+        "tracked" mode, where each chunk of frames starts with new features.
+    content_hash: bool, Optional
+        see _source_fingerprint
+    chunk_size: int, Optional
+        chunk_size of src.parallel_flow.iter_grid_flow_parallel, part of the key the same way as workers.
+    color_frames: bool, Optional
+        True if the flow was computed on color frames decoded and resized by the frame generator and then
+        converted to grayscale, False if the frame generator returned grayscale frames. The frames, and so
+        the flow, slightly differ.
+
+    Returns
+    -------
+        a hex string
+    """
+    params = {"version": CACHE_VERSION,
+              "source": _source_fingerprint(source, content_hash),
+              "grid_size": list(grid_size),
+              "flow_mode": flow_mode,
+              "working_resolution": None if working_resolution is None else list(working_resolution),
+              "stride": stride,
+              "color_frames": color_frames,
+              "workers": workers if flow_mode == "tracked" else 1,
+              "k_params": k_params,
+              "feature_params": feature_params,
+              "dense_params": dense_params,
+              "adaptive_params": adaptive_params}
+    if flow_mode == "tracked" and workers > 1:
+        params["chunk_size"] = chunk_size
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+class FlowCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_size=CACHE_MAX_SIZE):
+        """
+        An on-disk cache of flow files written by FlowStoreWriter, keyed by get_flow_key.
+
+        When the cache grows above max_size bytes the least recently used flow files are evicted.
+
+        Parameters
+        ----------
+        cache_dir: str, Optional
+            folder of the cache, defaults to $EGOVIDEO_CACHE_DIR or ~/.cache/egovideo-motion-segmentation
+        max_size: int, Optional
+            maximum size of the cache in bytes, defaults to $EGOVIDEO_CACHE_MAX_SIZE or 20GB
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _flow_file(self, key):
+        return join(self.cache_dir, key + ".npy")
+
+    def __contains__(self, key):
+        flow_file = self._flow_file(key)
+        return isfile(flow_file) and isfile(get_metadata_file(flow_file))
+
+    def fetch(self, key, flow_file, **metadata):
+        """ Copy a cached flow file and its metadata to flow_file.
+
+        Parameters
+        ----------
+        key: str
+            see get_flow_key
+        flow_file: str
+            path the flow file is copied to
+        metadata:
+            entries of the metadata to replace in the copy, e.g. the source.
+
+        Returns
+        -------
+            True if the flow was in the cache
+        """
+        if key not in self:
+            return False
+        cached_file = self._flow_file(key)
+        # The modification time orders the entries for eviction.
+        os.utime(cached_file)
+        shutil.copyfile(cached_file, flow_file)
+        with open(get_metadata_file(cached_file), "r") as handle:
+            cached_metadata = json.load(handle)
+        with open(get_metadata_file(flow_file), "w") as handle:
+            json.dump(dict(cached_metadata, **metadata), handle, indent=2)
+        return True
+
+    def put(self, key, flow_file):
+        """ Copy a flow file and its metadata into the cache and evict the least recently used entries
+        if the cache is too large."""
+        cached_file = self._flow_file(key)
+        logging.info("Saving the optical flow to the flow cache in {0}".format(self.cache_dir))
+        for src, dst in [(flow_file, cached_file), (get_metadata_file(flow_file), get_metadata_file(cached_file))]:
+            # The metadata is copied last so incomplete entries are not found.
+            shutil.copyfile(src, dst + ".tmp")
+            os.replace(dst + ".tmp", dst)
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used flow files until the cache is not larger than max_size."""
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith(".npy"):
+                flow_file = join(self.cache_dir, file)
+                files = [flow_file, get_metadata_file(flow_file)]
+                size = sum(os.path.getsize(f) for f in files if isfile(f))
+                entries.append((os.path.getmtime(flow_file), size, files))
+        entries.sort()
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, files in entries:
+            if total_size <= self.max_size:
+                break
+            logging.info("Evicting {0} from the flow cache".format(files[0]))
+            for f in files:
+                if isfile(f):
+                    os.remove(f)
+            total_size -= size
@@ -0,0 +1,189 @@
+import json
+import os
+import pickle
+import numpy as np
+from src.grid_optical_flow import get_grid_centres
+
+FLOW_DTYPE = np.float32
+
+
+def get_metadata_file(flow_file):
+    """ Returns the path of the metadata file belonging to a flow file."""
+    return os.path.splitext(flow_file)[0] + ".json"
+
+
+class FlowStoreWriter:
+    def __init__(self, flow_file, capacity, n_rows, n_cols, append=False, checkpoint_interval=0, **metadata):
+        """
+        Writes the grid optical flow of a video frame by frame into a memory mapped .npy file
+        of shape (frames, n_rows, n_cols, 2) holding the displacement vectors of the grid of each frame.
+        The grid origins are the same for every frame, they are saved once as "origins" in the metadata.
+
+        The array is preallocated for capacity frames and grown when more frames are appended.
+        The number of frames written and the metadata are saved next to it in a .json file at
+        every checkpoint, so the flow written up to the last checkpoint survives a crash.
+
+        Parameters
+        ----------
+        flow_file: str
+            path to the .npy file to create.
+        capacity: int
+            the expected number of frames.
+        n_rows: int
+            number of rows in the grid
+        n_cols: int
+            number of columns in the grid
+        append: bool, Optional
+            if True and the flow file exists, it is reopened and the frames are appended after
+            the frames of its last checkpoint. The metadata of the file is updated with metadata.
+        checkpoint_interval: int, Optional
+            the flow is flushed to disk every checkpoint_interval appended frames. 0 only flushes on close.
+        metadata:
+            additional information saved with the flow e.g. resolution, fps, source, stride.
+        """
+        self.flow_file = flow_file
+        self.checkpoint_interval = checkpoint_interval
+        metadata_file = get_metadata_file(flow_file)
+        if append and os.path.isfile(flow_file) and os.path.isfile(metadata_file):
+            with open(metadata_file, "r") as handle:
+                stored_metadata = json.load(handle)
+            for key, value in [("grid_size", [n_rows, n_cols]), ("resolution", metadata.get("resolution"))]:
+                if value is not None and stored_metadata.get(key, value) != value:
+                    raise ValueError("can not append flow with {0} {1} to {2} with {0} {3}".format(
+                        key, value, flow_file, stored_metadata[key]))
+            self.metadata = dict(stored_metadata, **metadata)
+            self._flow = np.load(flow_file, mmap_mode="r+")
+            if self._flow.ndim != 4:
+                raise ValueError("can not append to {0}, it has the layout of an earlier version".format(flow_file))
+            if capacity > len(self._flow):
+                self._grow(capacity)
+        else:
+            self.metadata = dict(metadata, grid_size=[n_rows, n_cols], frames=0)
+            self._flow = np.lib.format.open_memmap(flow_file, mode="w+", dtype=FLOW_DTYPE,
+                                                   shape=(max(capacity, 1), n_rows, n_cols, 2))
+
+    def __len__(self):
+        return self.metadata["frames"]
+
+    def append(self, origins, displacements, source_frame=None):
+        """ Append the flow of the next frame.
+
+        Parameters
+        ----------
+        origins: numpy array
+            the grid origins with shape (n_rows, n_cols, 2)
+        displacements: numpy array
+            the displaced grid origins with shape (n_rows, n_cols, 2)
+        source_frame: int, Optional
+            index of the frame in the source video, saved as "last_frame" in the metadata
+            so a computation can be resumed after it.
+        """
+        frame_idx = self.metadata["frames"]
+        if frame_idx == len(self._flow):
+            self._grow(2 * len(self._flow))
+        if "origins" not in self.metadata:
+            self.metadata["origins"] = np.asarray(origins).tolist()
+        np.subtract(displacements, origins, out=self._flow[frame_idx], casting="unsafe")
+        self.metadata["frames"] = frame_idx + 1
+        if source_frame is not None:
+            self.metadata["last_frame"] = source_frame
+        if self.checkpoint_interval > 0 and self.metadata["frames"] % self.checkpoint_interval == 0:
+            self.flush()
+
+    def append_vectors(self, origins, vectors, source_frame=None):
+        """ Append the flow of the next frames given as the displacement vectors of the grid,
+        the layout of the flow file, so they are written without conversion.
+
+        Parameters
+        ----------
+        origins: numpy array
+            the grid origins with shape (n_rows, n_cols, 2)
+        vectors: numpy array
+            the displacement vectors of the grid of each frame with shape (frames, n_rows, n_cols, 2)
+        source_frame: int, Optional
+            index of the last frame in the source video, see append.
+        """
+        start = self.metadata["frames"]
+        stop = start + len(vectors)
+        if stop > len(self._flow):
+            self._grow(max(2 * len(self._flow), stop))
+        if "origins" not in self.metadata:
+            self.metadata["origins"] = np.asarray(origins).tolist()
+        self._flow[start:stop] = vectors
+        self.metadata["frames"] = stop
+        if source_frame is not None:
+            self.metadata["last_frame"] = source_frame
+        if self.checkpoint_interval > 0 and stop // self.checkpoint_interval > start // self.checkpoint_interval:
+            self.flush()
+
+    def flush(self):
+        """ Write the flow and the metadata to disk. The metadata is replaced atomically after
+        the flow is written, so it never counts frames which are not on disk."""
+        self._flow.flush()
+        metadata_file = get_metadata_file(self.flow_file)
+        with open(metadata_file + ".tmp", "w") as handle:
+            json.dump(self.metadata, handle, indent=2)
+        os.replace(metadata_file + ".tmp", metadata_file)
+
+    def close(self):
+        self.flush()
+        del self._flow
+
+    def _grow(self, capacity):
+        tmp_file = self.flow_file + ".tmp"
+        flow = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=FLOW_DTYPE,
+                                         shape=(capacity,) + self._flow.shape[1:])
+        flow[:len(self._flow)] = self._flow
+        flow.flush()
+        del self._flow
+        del flow
+        os.replace(tmp_file, self.flow_file)
+        self._flow = np.load(self.flow_file, mmap_mode="r+")
+
+
+def _get_origins(flow_file, metadata):
+    """ Returns the grid origins of a flow file. They are rebuilt from the resolution and the grid size
+    if the store was closed before its first frame."""
+    if "origins" in metadata:
+        return np.array(metadata["origins"])
+    if metadata.get("resolution") is not None and metadata.get("grid_size") is not None:
+        width, height = metadata["resolution"]
+        return np.array(get_grid_centres(height, width, *metadata["grid_size"]))
+    raise ValueError("the grid origins of {0} are unknown, its metadata has neither origins nor "
+                     "a resolution and a grid size".format(flow_file))
+
+
+def load_flow(flow_file, mmap_mode="r"):
+    """ Load a flow file without reading it into memory.
+
+    Parameters
+    ----------
+    flow_file: str
+        path to a flow file written by FlowStoreWriter. Flow files of earlier versions, pickled or
+        holding the origins of every frame, are also accepted and are converted in memory.
+    mmap_mode: str, Optional
+        see numpy.load
+
+    Returns
+    -------
+        - a numpy array of shape (n_rows, n_cols, 2) with the grid origins
+        - a (memory mapped) numpy array of shape (frames, n_rows, n_cols, 2) with the displacement
+        vectors of the grid of each frame
+        - the metadata dictionary of the flow file
+    """
+    metadata_file = get_metadata_file(flow_file)
+    if not os.path.isfile(metadata_file):
+        with open(flow_file, "rb") as handle:
+            flow = pickle.load(handle)
+        flow = np.swapaxes(flow, 0, 1)
+        metadata = {"frames": len(flow)}
+    else:
+        with open(metadata_file, "r") as handle:
+            metadata = json.load(handle)
+        flow = np.load(flow_file, mmap_mode=mmap_mode)[:metadata["frames"]]
+        if flow.ndim == 4:
+            return _get_origins(flow_file, metadata), flow, metadata
+
+    # (frames, 2, n_rows, n_cols, 2) flow of an earlier version
+    vectors = np.subtract(flow[:, 1], flow[:, 0], dtype=FLOW_DTYPE)
+    return np.array(flow[0, 0]), vectors, metadata
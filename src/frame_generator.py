@@ -1,17 +1,54 @@
 import cv2
+import queue
+import threading
+import time
 from abc import ABC, abstractmethod
-from src.video import get_video_info, prettify_video_info
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from PIL import Image
+from src import profiling
+from src.video import get_video_info, get_keyframe_index, prettify_video_info
 from os import listdir
 from os.path import isfile, join
 
+EXIF_ORIENTATION = 0x0112
+
+
+def snap_resolution(resolution, grid_size):
+    """ Shrink a resolution so it is divisible by a grid.
+
+    Parameters
+    ----------
+    resolution: Tuple(int)
+        (width, height)
+    grid_size: Tuple(int)
+        (n_rows, n_cols) of the grid
+
+    Returns
+    -------
+        the largest (width, height) not larger than resolution where the width is divisible
+        by n_cols and the height is divisible by n_rows.
+    """
+    width, height = resolution
+    n_rows, n_cols = grid_size
+    return width - width % n_cols, height - height % n_rows
+
 
 class FrameGenerator:
     def __init__(
-            self, source, frame_count, resolution, every_nth_frame=1, use_rgb=True
+            self, source, frame_count, resolution, every_nth_frame=1, use_rgb=True,
+            working_resolution=None, grid_size=None, grayscale=False
     ):
         self._frame_count = frame_count
         self.use_rgb = use_rgb
+        self.grayscale = grayscale
         self.every_nth_frame = every_nth_frame
+        self.source_resolution = tuple(resolution)
+        resolution = self.source_resolution if working_resolution is None else tuple(working_resolution)
+        if grid_size is not None:
+            resolution = snap_resolution(resolution, grid_size)
         self.resolution = resolution
         self.source = source
 
@@ -19,13 +56,54 @@ class FrameGenerator:
     def __iter__(self):
         pass
 
+    @abstractmethod
+    def get_frame(self, frame_idx):
+        """ Returns the frame at frame_idx of the source converted like the frames of __iter__.
+        every_nth_frame is ignored, frame_idx counts every frame of the source.
+        """
+        pass
+
+    def iter_range(self, start, stop=None, step=1):
+        """ Yields the frames start, start + step, ... before stop of the source.
+
+        Parameters
+        ----------
+        start: int
+            index of the first frame
+        stop: int, Optional
+            exclusive end of the range, None reads until the end of the source.
+        step: int, Optional
+            distance between the yielded frames, every_nth_frame is ignored.
+
+        Returns
+        -------
+        a nupy array representing a frame
+        """
+        stop = self._frame_count if stop is None else min(stop, self._frame_count)
+        for frame_idx in range(start, stop, step):
+            yield self.get_frame(frame_idx)
+
     def __len__(self):
         return self._frame_count // self.every_nth_frame
 
+    def _convert_frame(self, frame):
+        """ Convert a decoded frame to the color mode and resolution of the generator."""
+        with profiling.stage("color conversion"):
+            if self.grayscale:
+                if frame.ndim == 3:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            elif self.use_rgb:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if frame.shape[1::-1] != self.resolution:
+            with profiling.stage("resize"):
+                frame = cv2.resize(frame, self.resolution, interpolation=cv2.INTER_AREA)
+        return frame
+
 
 class FrameGeneratorVideo(FrameGenerator):
     def __init__(
-            self, video_source, show_video_info=True, every_nth_frame=1, use_rgb=True
+            self, video_source, show_video_info=True, every_nth_frame=1, use_rgb=True,
+            working_resolution=None, grid_size=None, grayscale=False
     ):
         """
         Init
@@ -43,6 +121,16 @@ class FrameGeneratorVideo(FrameGenerator):
 
         use_rgb: bool, Optional
             if True RGB image will be returned else the colore mode is cv2 default bgr.
+
+        working_resolution: Tuple(int), Optional
+            (width, height) the frames are resized to. None keeps the resolution of the video.
+
+        grid_size: Tuple(int), Optional
+            (n_rows, n_cols) of the optical flow grid. If given, the resolution is shrunk
+            to be divisible by the grid.
+
+        grayscale: bool, Optional
+            if True grayscale frames are returned and use_rgb is ignored.
         """
 
         video_file, frame_count, fps, length, height, width = get_video_info(
@@ -56,65 +144,444 @@ class FrameGeneratorVideo(FrameGenerator):
             )
         self.fps = fps
         self.length = length
+        self._video_file = video_file
         self._cap = cv2.VideoCapture(video_file)
+        self._seek_cap = None
+        self._seek_position = None
         if not self._cap.isOpened():
             raise ValueError("could not open video file: {0}".format(video_file))
         super().__init__(source=video_source,
                          frame_count=frame_count,
                          resolution=(width, height),
                          every_nth_frame=every_nth_frame,
-                         use_rgb=use_rgb)
+                         use_rgb=use_rgb,
+                         working_resolution=working_resolution,
+                         grid_size=grid_size,
+                         grayscale=grayscale)
+
+    @property
+    def keyframes(self):
+        """ The keyframe indices of the video, see src.video.get_keyframe_index."""
+        if not hasattr(self, "_keyframes"):
+            self._keyframes = get_keyframe_index(self._video_file)
+        return self._keyframes
+
+    def _move_capture(self, cap, position, frame_idx):
+        """ Position a capture at frame_idx and return the index of its next frame.
+
+        The capture jumps to the last keyframe before frame_idx and grabs the frames up to
+        frame_idx, unless position, the index of the next frame of the capture, already lies
+        between that keyframe and frame_idx. Without a keyframe index opencv seeks on its own.
+        """
+        keyframes = self.keyframes
+        if keyframes is None:
+            if position != frame_idx:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            return frame_idx
+
+        keyframe = keyframes[bisect_right(keyframes, frame_idx) - 1]
+        if position is None or not keyframe <= position <= frame_idx:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            position = keyframe
+        while position < frame_idx and cap.grab():
+            position += 1
+        return position
+
+    def seek(self, frame_idx):
+        """ Set the index of the next frame read by the generator."""
+        self._move_capture(self._cap, None, frame_idx)
+
+    def get_frame(self, frame_idx):
+        """ Returns the frame at frame_idx of the video converted like the frames of __iter__.
+        every_nth_frame is ignored, frame_idx counts every frame of the video.
+
+        Random access uses its own capture, so it does not disturb the iteration of the generator.
+        Consecutive calls with increasing indices decode forward instead of seeking.
+        """
+        if not 0 <= frame_idx < self._frame_count:
+            raise IndexError("frame index out of range: {0}".format(frame_idx))
+        for frame in self.iter_range(frame_idx, frame_idx + 1):
+            return frame
+        raise IndexError("could not read frame {0} of {1}".format(frame_idx, self._video_file))
+
+    def iter_range(self, start, stop=None, step=1):
+        """ Yields the frames start, start + step, ... before stop of the video.
+
+        The capture jumps to the keyframe before start and decodes forward from there. Frames
+        in between are only grabbed and a keyframe is jumped to when it skips frames.
+
+        Parameters
+        ----------
+        start: int
+            index of the first frame
+        stop: int, Optional
+            exclusive end of the range, None reads until the end of the video.
+        step: int, Optional
+            distance between the yielded frames, every_nth_frame is ignored.
+
+        Returns
+        -------
+        a nupy array representing a frame
+        """
+        if self._seek_cap is None:
+            self._seek_cap = cv2.VideoCapture(self._video_file)
+        frame_idx = start
+        while stop is None or frame_idx < stop:
+            self._seek_position = self._move_capture(self._seek_cap, self._seek_position, frame_idx)
+            with profiling.stage("decode"):
+                ret, frame = self._seek_cap.read()
+            if not ret or frame is None:
+                self._seek_position = None
+                return
+            self._seek_position += 1
+            yield self._convert_frame(frame)
+            frame_idx += step
 
     def __iter__(self):
         """ Read frame from an opencv capture objects and yields
         until this object is not closed.
 
+        Skipped frames are only grabbed, they are not decoded.
+
         Returns
         -------
         a nupy array representing an RGB frame
         """
-        cnt = -1
+        cnt = 0
         while self._cap.isOpened():
-            ret, frame = self._cap.read()
-            cnt += 1
             if cnt % self.every_nth_frame != 0:
+                with profiling.stage("grab"):
+                    grabbed = self._cap.grab()
+                if not grabbed:
+                    break
+                cnt += 1
                 continue
-            if frame is None:
-                return
-            if self.use_rgb:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            yield frame
+            with profiling.stage("decode"):
+                ret, frame = self._cap.read()
+            cnt += 1
+            if not ret or frame is None:
+                break
+            yield self._convert_frame(frame)
         self._cap.release()
-        raise StopIteration()
 
 
 class FrameGeneratorImageSequence(FrameGenerator):
     def __init__(
-            self, video_source, every_nth_frame=1, use_rgb=True
+            self, video_source, every_nth_frame=1, use_rgb=True,
+            working_resolution=None, grid_size=None, grayscale=False, workers=4, read_ahead=16,
+            reduced_decode=True
     ):
+        """
+        Init
+        Parameters
+        ----------
+        video_source: str
+            path to the folder of the images. The images are read in the order of their file names.
+
+        every_nth_frame: int
+            every nth image will be yielded by the generator.
+
+        use_rgb: bool, Optional
+            if True RGB image will be returned else the colore mode is cv2 default bgr.
 
+        working_resolution: Tuple(int), Optional
+            (width, height) the images are resized to. None keeps the resolution of the images.
+
+        grid_size: Tuple(int), Optional
+            (n_rows, n_cols) of the optical flow grid. If given, the resolution is shrunk
+            to be divisible by the grid.
+
+        grayscale: bool, Optional
+            if True grayscale frames are returned and use_rgb is ignored.
+
+        workers: int, Optional
+            number of threads decoding the images. 0 decodes them on the calling thread.
+
+        read_ahead: int, Optional
+            maximum number of images decoded ahead of the consumer.
+
+        reduced_decode: bool, Optional
+            if True and the working resolution is at most half of the image resolution, the images
+            are decoded at 1/2, 1/4 or 1/8 of their size (cv2.IMREAD_REDUCED_*) before resizing.
+        """
         self._video_files = [join(video_source, f) for f in listdir(video_source) if isfile(join(video_source, f))]
         self._video_files.sort()
-        sample_img = cv2.imread(self._video_files[0])
+        with Image.open(self._video_files[0]) as sample_img:
+            # Only the header is read. cv2.imread applies the EXIF orientation, so rotated images are swapped.
+            resolution = sample_img.size
+            if sample_img.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+                resolution = resolution[::-1]
 
         super().__init__(source=video_source,
                          frame_count=len(self._video_files),
-                         resolution=sample_img.shape[1::-1],
+                         resolution=resolution,
                          every_nth_frame=every_nth_frame,
-                         use_rgb=use_rgb)
+                         use_rgb=use_rgb,
+                         working_resolution=working_resolution,
+                         grid_size=grid_size,
+                         grayscale=grayscale)
+        self.workers = workers
+        self.read_ahead = max(read_ahead, workers, 1)
+        self.imread_flags = self._get_imread_flags(reduced_decode)
+        self._start = 0
+
+    def _get_imread_flags(self, reduced_decode):
+        """ Returns the cv2.imread flags decoding the images as small as possible without going
+        below the resolution of the generator."""
+        reduced_flags = {2: (cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_COLOR_2),
+                         4: (cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_COLOR_4),
+                         8: (cv2.IMREAD_REDUCED_GRAYSCALE_8, cv2.IMREAD_REDUCED_COLOR_8)}
+        flags = (cv2.IMREAD_GRAYSCALE, cv2.IMREAD_COLOR)
+        if reduced_decode:
+            for factor, factor_flags in reduced_flags.items():
+                if all(source // factor >= target for source, target in zip(self.source_resolution, self.resolution)):
+                    flags = factor_flags
+        return flags[0] if self.grayscale else flags[1]
+
+    def seek(self, frame_idx):
+        """ Set the index of the next image read by the generator."""
+        self._start = frame_idx
 
     def __iter__(self):
-        """ Read frame from an opencv capture objects and yields
-        until this object is not closed.
+        """ Reads the images in order with a pool of threads and yields them.
 
         Returns
         -------
         a nupy array representing an RGB frame
         """
-        for img_file in self._video_files[0::self.every_nth_frame]:
-            frame = cv2.imread(img_file)
-            if self.use_rgb:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        img_files = self._video_files[self._start::self.every_nth_frame]
+        if self.workers == 0:
+            for img_file in img_files:
+                yield self._read_image(img_file)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            img_files = iter(img_files)
+            try:
+                for img_file in islice(img_files, self.read_ahead):
+                    pending.append(executor.submit(self._read_image, img_file))
+                while pending:
+                    frame = pending.popleft().result()
+                    for img_file in islice(img_files, 1):
+                        pending.append(executor.submit(self._read_image, img_file))
+                    yield frame
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _read_image(self, img_file):
+        with profiling.stage("decode"):
+            frame = cv2.imread(img_file, self.imread_flags)
+        if frame is None:
+            raise ValueError("could not read image file: {0}".format(img_file))
+        return self._convert_frame(frame)
+
+    def get_frame(self, frame_idx):
+        """ Returns the image at frame_idx of the sequence converted like the frames of __iter__.
+        every_nth_frame is ignored, frame_idx counts every image of the sequence.
+        """
+        return self._read_image(self._video_files[frame_idx])
+
+
+class FrameGeneratorStream(FrameGenerator):
+    def __init__(
+            self, stream_source, show_video_info=True, use_rgb=True, working_resolution=None, grid_size=None,
+            grayscale=False, realtime=False, buffer_size=1
+    ):
+        """
+        Reads a live source, e.g. a camera, on a background thread. When the consumer falls behind,
+        the oldest captured frames are dropped, so the frames it gets are at most buffer_size frames old.
+
+        Parameters
+        ----------
+        stream_source: int or str
+            index of a camera device or the url of a stream. A path of a video file can be given
+            as a stand-in for a camera, see realtime.
+
+        show_video_info: bool
+            if true then the stream info is printed to the console
 
+        use_rgb: bool, Optional
+            if True RGB image will be returned else the colore mode is cv2 default bgr.
+
+        working_resolution: Tuple(int), Optional
+            (width, height) the frames are resized to. None keeps the resolution of the stream.
+
+        grid_size: Tuple(int), Optional
+            (n_rows, n_cols) of the optical flow grid. If given, the resolution is shrunk
+            to be divisible by the grid.
+
+        grayscale: bool, Optional
+            if True grayscale frames are returned and use_rgb is ignored.
+
+        realtime: bool, Optional
+            if True the frames are captured at the pace of the fps of the source. Use it to play
+            a video file back like a camera would deliver it.
+
+        buffer_size: int, Optional
+            maximum number of captured frames waiting for the consumer.
+        """
+        self._cap = cv2.VideoCapture(stream_source)
+        if not self._cap.isOpened():
+            raise ValueError("could not open stream: {0}".format(stream_source))
+        width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = self._cap.get(cv2.CAP_PROP_FPS)
+        if show_video_info:
+            print(prettify_video_info(stream_source, "-", fps, 0, width, height))
+        self.fps = fps if fps > 0 else None
+        self.realtime = realtime
+        self.captured = 0
+        self.dropped = 0
+        self._frames = deque(maxlen=max(buffer_size, 1))
+        self._available = threading.Condition()
+        self._finished = False
+        self._stop = threading.Event()
+        super().__init__(source=stream_source,
+                         frame_count=0,
+                         resolution=(width, height),
+                         use_rgb=use_rgb,
+                         working_resolution=working_resolution,
+                         grid_size=grid_size,
+                         grayscale=grayscale)
+
+    def __len__(self):
+        raise TypeError("a stream has no length")
+
+    def get_frame(self, frame_idx):
+        raise TypeError("a stream can not be read at random")
+
+    def _capture(self):
+        start = time.perf_counter()
+        frame_idx = 0
+        while not self._stop.is_set():
+            if self.realtime and self.fps is not None:
+                delay = start + frame_idx / self.fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            with profiling.stage("decode"):
+                ret, frame = self._cap.read()
+            if not ret or frame is None:
+                break
+            with self._available:
+                if len(self._frames) == self._frames.maxlen:
+                    self.dropped += 1
+                self._frames.append((frame_idx, time.perf_counter(), frame))
+                self.captured += 1
+                self._available.notify()
+            frame_idx += 1
+        with self._available:
+            self._finished = True
+            self._available.notify()
+        self._cap.release()
+
+    def iter_timed(self):
+        """ Yields the captured frames with their index in the stream and their capture time.
+        Indices are missing where frames were dropped.
+
+        Returns
+        -------
+        (frame_idx, capture_time, frame) tuples, capture_time is the time.perf_counter() of the capture.
+        """
+        thread = threading.Thread(target=self._capture, daemon=True)
+        thread.start()
+        try:
+            while True:
+                with self._available:
+                    while not self._frames and not self._finished:
+                        self._available.wait()
+                    if not self._frames:
+                        return
+                    frame_idx, capture_time, frame = self._frames.popleft()
+                yield frame_idx, capture_time, self._convert_frame(frame)
+        finally:
+            self._stop.set()
+            thread.join()
+
+    def __iter__(self):
+        """ Yields the captured frames until the stream ends.
+
+        Returns
+        -------
+        a nupy array representing a frame
+        """
+        for _, _, frame in self.iter_timed():
             yield frame
-        raise StopIteration()
+
+
+class PrefetchFrameGenerator(FrameGenerator):
+    _END = object()
+
+    def __init__(self, frame_generator, depth=8):
+        """
+        Wraps a frame generator and reads its frames ahead on a background thread so
+        decoding overlaps with the processing of the frames.
+
+        Parameters
+        ----------
+        frame_generator: FrameGenerator
+            the frame generator to read from.
+
+        depth: int, Optional
+            maximum number of frames read ahead.
+        """
+        self._frame_generator = frame_generator
+        self.depth = depth
+        super().__init__(source=frame_generator.source,
+                         frame_count=frame_generator._frame_count,
+                         resolution=frame_generator.resolution,
+                         every_nth_frame=frame_generator.every_nth_frame,
+                         use_rgb=frame_generator.use_rgb,
+                         grayscale=frame_generator.grayscale)
+
+    def __getattr__(self, name):
+        return getattr(self._frame_generator, name)
+
+    def get_frame(self, frame_idx):
+        return self._frame_generator.get_frame(frame_idx)
+
+    def iter_range(self, start, stop=None, step=1):
+        return self._frame_generator.iter_range(start, stop, step)
+
+    def __iter__(self):
+        """ Yields the frames of the wrapped frame generator in the same order.
+
+        Returns
+        -------
+        a nupy array representing a frame
+        """
+        frames = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read():
+            try:
+                for frame in self._frame_generator:
+                    if not put(frame):
+                        return
+                put(self._END)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=read, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
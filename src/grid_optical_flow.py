@@ -1,5 +1,10 @@
+import cv2
 import numpy as np
-from src.optical_flow import get_displacements
+from functools import lru_cache
+from src import profiling
+from src.frame_generator import snap_resolution
+from src.optical_flow import get_displacements, get_grid_features, track_features, get_dense_flow, dense_params, \
+    adaptive_params
 
 
 def split(array, n_rows, n_cols):
@@ -48,8 +53,9 @@ def split(array, n_rows, n_cols):
     return np.array(blocks)
 
 
-def get_grid_flow(image1, image2, n_rows, n_cols):
-    """ Calculate an optical flow for each image block defind by grid.
+def get_block_flow(image1, image2, n_rows, n_cols):
+    """ Calculate the mean displacement of each grid block by running the
+    feature detector and tracker separately on every image block.
 
     Parameters
     ----------
@@ -64,12 +70,12 @@ def get_grid_flow(image1, image2, n_rows, n_cols):
 
     Return
     ------
-        A numpy array of shape (n_rows, n_cols, 2) where each image block is assigned with
-        a 2D vector (relative to is centre) representing its average displacement.
+        A numpy array of shape (n_rows, n_cols, 2) holding the mean displacement of each block.
     """
     # Get image blocks
-    image1_blocks = split(image1, n_rows, n_cols)
-    image2_blocks = split(image2, n_rows, n_cols)
+    with profiling.stage("split"):
+        image1_blocks = split(image1, n_rows, n_cols)
+        image2_blocks = split(image2, n_rows, n_cols)
 
     # Compute optical flow for each block
     block_flow = [*map(lambda x: get_displacements(*x), zip(image1_blocks, image2_blocks))]
@@ -78,16 +84,205 @@ def get_grid_flow(image1, image2, n_rows, n_cols):
     # Calculate the mean displacements for each block
     mean_block_dispalcements = np.array([*map(lambda d: np.mean(d, axis=0), block_displacements)])
     # Reshape the displacements so it has the grid like shape.
+    return mean_block_dispalcements.reshape(n_rows, n_cols, 2)
+
+
+def get_batched_flow(image1, image2, n_rows, n_cols):
+    """ Calculate the mean displacement of each grid block with a single feature
+    detection and a single LK tracking call on the whole image.
+
+    Parameters
+    ----------
+    image1 : numpy array
+        image1 a grayscale image
+    image2 : numpy array
+        image2 a grayscale image
+    n_rows : int
+        number of rows in the grid
+    n_cols : int
+        number of columns in the grid
+
+    Return
+    ------
+        A numpy array of shape (n_rows, n_cols, 2) holding the mean displacement of each block.
+    """
+    points, cells = get_grid_features(image1, n_rows, n_cols)
+    new_points, found = track_features(image1, image2, points)
+    displacements = new_points[found] - points.reshape(-1, 2)[found]
+    return bin_to_grid(cells[found], displacements, n_rows, n_cols)
+
+
+def bin_to_grid(cells, vectors, n_rows, n_cols):
+    """ Average a set of 2D vectors per grid cell.
+
+    Parameters
+    ----------
+    cells : numpy array
+        array of shape (N,) with the flat index of the grid cell of each vector
+    vectors : numpy array
+        array of shape (N, 2)
+    n_rows : int
+        number of rows in the grid
+    n_cols : int
+        number of columns in the grid
+
+    Return
+    ------
+        A numpy array of shape (n_rows, n_cols, 2) holding the mean vector of each cell.
+        Cells without any vector are assigned with a zero vector.
+    """
+    n_cells = n_rows * n_cols
+    counts = np.bincount(cells, minlength=n_cells)
+    sum_x = np.bincount(cells, weights=vectors[:, 0], minlength=n_cells)
+    sum_y = np.bincount(cells, weights=vectors[:, 1], minlength=n_cells)
+    means = np.stack((sum_x, sum_y), axis=-1) / np.maximum(counts, 1)[:, None]
+    return means.reshape(n_rows, n_cols, 2)
+
+
+def get_dense_grid_flow(image1, image2, n_rows, n_cols):
+    """ Calculate the mean displacement of each grid block from a dense DIS optical flow.
+
+    The flow is computed on the images downscaled to dense_params["max_width"] and the
+    displacements of each block are averaged by a single reshape and mean.
+
+    Parameters
+    ----------
+    image1 : numpy array
+        image1 a grayscale image
+    image2 : numpy array
+        image2 a grayscale image
+    n_rows : int
+        number of rows in the grid
+    n_cols : int
+        number of columns in the grid
+
+    Return
+    ------
+        A numpy array of shape (n_rows, n_cols, 2) holding the mean displacement of each block.
+    """
+    h, w = image1.shape
+    size = (w, h)
+    if w > dense_params["max_width"]:
+        size = (dense_params["max_width"], max(n_rows, round(h * dense_params["max_width"] / w)))
+    # The downscaled size has to be divisible by the grid as well.
+    size = snap_resolution(size, (n_rows, n_cols))
+    flow = get_dense_flow(image1, image2, size)
+    return flow.reshape(n_rows, size[1] // n_rows, n_cols, size[0] // n_cols, 2).mean(axis=(1, 3))
+
+
+def get_cell_changes(image1, image2, n_rows, n_cols):
+    """ A cheap measure of the change of each grid block between two images.
+
+    The images are downscaled to adaptive_params["cell_size"] pixels per block side and the
+    absolute difference is averaged over each block.
+
+    Parameters
+    ----------
+    image1 : numpy array
+        image1 a grayscale image
+    image2 : numpy array
+        image2 a grayscale image
+    n_rows : int
+        number of rows in the grid
+    n_cols : int
+        number of columns in the grid
+
+    Return
+    ------
+        A numpy array of shape (n_rows, n_cols) holding the mean absolute difference of each block in gray levels.
+    """
+    cell_size = adaptive_params["cell_size"]
+    with profiling.stage("cell changes"):
+        size = (n_cols * cell_size, n_rows * cell_size)
+        diff = cv2.absdiff(cv2.resize(image1, size, interpolation=cv2.INTER_AREA),
+                           cv2.resize(image2, size, interpolation=cv2.INTER_AREA))
+        return diff.reshape(n_rows, cell_size, n_cols, cell_size).mean(axis=(1, 3))
+
+
+def get_adaptive_grid_flow(image1, image2, n_rows, n_cols):
+    """ Same as get_block_flow but the feature tracker only runs on the blocks which changed
+    between the images, see get_cell_changes. The other blocks are assigned with a zero displacement,
+    so frame pairs without any change cost a downscale and a difference only.
+
+    Parameters
+    ----------
+    image1 : numpy array
+        image1 a grayscale image
+    image2 : numpy array
+        image2 a grayscale image
+    n_rows : int
+        number of rows in the grid
+    n_cols : int
+        number of columns in the grid
+
+    Return
+    ------
+        A numpy array of shape (n_rows, n_cols, 2) holding the mean displacement of each block.
+    """
+    changed = np.flatnonzero(get_cell_changes(image1, image2, n_rows, n_cols) > adaptive_params["change_threshold"])
+    profiling.count("adaptive cells computed", len(changed))
+    profiling.count("adaptive cells skipped", n_rows * n_cols - len(changed))
+
+    h, w = image1.shape
+    block_height, block_width = h // n_rows, w // n_cols
+    mean_displacements = np.zeros((n_rows * n_cols, 2))
+    for cell in changed:
+        y, x = (cell // n_cols) * block_height, (cell % n_cols) * block_width
+        origin, displacement = get_displacements(image1[y:y + block_height, x:x + block_width],
+                                                 image2[y:y + block_height, x:x + block_width])
+        mean_displacements[cell] = np.mean(displacement - origin, axis=0)
+    return mean_displacements.reshape(n_rows, n_cols, 2)
+
+
+# Optical flow backends, functions of (image1, image2, n_rows, n_cols) returning the mean
+# displacement of each grid block with shape (n_rows, n_cols, 2).
+FLOW_MODES = {
+    "block": get_block_flow,
+    "batched": get_batched_flow,
+    "dense": get_dense_grid_flow,
+    "adaptive": get_adaptive_grid_flow,
+}
+
+
+def get_grid_flow(image1, image2, n_rows, n_cols, mode="block"):
+    """ Calculate an optical flow for each image block defind by grid.
 
-    mean_block_dispalcements = mean_block_dispalcements.reshape(n_rows, n_cols, 2).astype(np.int)
+    Parameters
+    ----------
+    image1 : numpy array
+        image1 a grayscale image
+    image2 : numpy array
+        image2 a grayscale image
+    n_rows : int
+        number of rows in the grid
+    n_cols : int
+        number of columns in the grid
+    mode : str, Optional
+        one of FLOW_MODES. "block" runs the feature tracker on each image block separately,
+        "batched" detects and tracks the features of all blocks at once, "dense" averages a dense
+        DIS optical flow over each block, "adaptive" runs the feature tracker only on the blocks
+        which changed.
+
+    Return
+    ------
+        - A numpy array of shape (n_rows, n_cols, 2) with the centre of each image block.
+        - A numpy array of shape (n_rows, n_cols, 2) where each image block is assigned with
+        its centre moved by its average displacement, with sub-pixel precision.
+    """
+    if mode not in FLOW_MODES:
+        raise ValueError("unknown optical flow mode: {0}".format(mode))
+    mean_block_dispalcements = FLOW_MODES[mode](image1, image2, n_rows, n_cols)
     origins = get_grid_centres(*image1.shape[0:2], n_rows, n_cols)
 
     return origins, mean_block_dispalcements+origins
 
+
+@lru_cache(maxsize=16)
 def get_grid_centres(h, w, n_rows, n_cols):
     """Calculate a grid block centres on a given canvas size.
 
-    Note that canvas size must me divisible by grid.
+    Note that canvas size must me divisible by grid. The centres are computed once for each
+    canvas size and grid, the returned array is shared and read-only.
 
     Parameters
     ----------
@@ -115,4 +310,112 @@ def get_grid_centres(h, w, n_rows, n_cols):
     y = np.linspace(0, h, n_rows, endpoint=False)
     x += block_width // 2
     y += block_height // 2
-    return np.rollaxis(np.rollaxis(np.array(np.meshgrid(x, y)),-1),-1).astype(np.int)
\ No newline at end of file
+    centres = np.rollaxis(np.rollaxis(np.array(np.meshgrid(x, y)),-1),-1).astype(int)
+    centres.setflags(write=False)
+    return centres
+
+
+TRACKER_MODES = [*FLOW_MODES.keys(), "tracked"]
+
+
+class GridFlowTracker:
+    def __init__(self, n_rows, n_cols, mode="tracked", min_features_per_cell=10, empty_retry_interval=10):
+        """
+        Computes the grid flow between consecutive frames of a sequence.
+
+        In "tracked" mode the previous frame and the features tracked into it are kept, so
+        the features found on a frame are tracked on through the following frames and the
+        corner detection only runs on the grid cells which have too few tracked features left.
+        The other modes call get_grid_flow on each frame pair.
+
+        Parameters
+        ----------
+        n_rows : int
+            number of rows in the grid
+        n_cols : int
+            number of columns in the grid
+        mode : str, Optional
+            one of TRACKER_MODES.
+        min_features_per_cell: int, Optional
+            In "tracked" mode the features of a grid cell are re-detected once it contains
+            fewer tracked features than this, or than its last detection found if that was fewer.
+        empty_retry_interval: int, Optional
+            In "tracked" mode the grid cells without any feature, e.g. flat ones, are re-detected
+            on every empty_retry_interval-th frame.
+        """
+        if mode not in TRACKER_MODES:
+            raise ValueError("unknown optical flow mode: {0}".format(mode))
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.mode = mode
+        self.min_features_per_cell = min_features_per_cell
+        self.empty_retry_interval = empty_retry_interval
+        self.reset()
+
+    def reset(self):
+        """ Forget the previous frame, the next update starts a new sequence."""
+        self._frame = None
+        self._points = None
+        self._origins = None
+        self._detected = None
+        self._n_frames = 0
+
+    def update(self, frame):
+        """ Add the next grayscale frame of the sequence.
+
+        Parameters
+        ----------
+        frame : numpy array
+            a grayscale image
+
+        Return
+        ------
+            None for the first frame of a sequence, otherwise the grid flow between the previous
+            and this frame in the same format as get_grid_flow returns it.
+        """
+        if self.mode != "tracked":
+            p_frame, self._frame = self._frame, frame
+            if p_frame is None:
+                return None
+            return get_grid_flow(p_frame, frame, self.n_rows, self.n_cols, mode=self.mode)
+
+        self._n_frames += 1
+        if self._frame is None:
+            self._origins = get_grid_centres(*frame.shape[0:2], self.n_rows, self.n_cols)
+            self._frame = frame
+            self._points, cells = get_grid_features(frame, self.n_rows, self.n_cols)
+            self._detected = np.bincount(cells, minlength=self.n_rows * self.n_cols)
+            return None
+
+        h, w = frame.shape[0:2]
+        points = self._points.reshape(-1, 2)
+        new_points, found = track_features(self._frame, frame, self._points)
+        mean_displacements = bin_to_grid(self._get_cells(points[found], h, w),
+                                         new_points[found] - points[found],
+                                         self.n_rows, self.n_cols)
+
+        # Carry the features which are still on the frame over to the next frame pair.
+        found &= (new_points[:, 0] >= 0) & (new_points[:, 0] < w) & (new_points[:, 1] >= 0) & (new_points[:, 1] < h)
+        points = new_points[found]
+        cells = self._get_cells(points, h, w)
+        counts = np.bincount(cells, minlength=self.n_rows * self.n_cols)
+        # A cell whose last detection found fewer features than the minimum, e.g. a flat one, is only
+        # re-detected once it loses some of those. Empty cells are retried periodically, they might
+        # have been flat or dark only when they were detected.
+        depleted = counts < np.minimum(self._detected, self.min_features_per_cell)
+        if self._n_frames % self.empty_retry_interval == 0:
+            depleted |= counts == 0
+        if np.any(depleted):
+            depleted_cells = np.flatnonzero(depleted)
+            new_features, new_cells = get_grid_features(frame, self.n_rows, self.n_cols, depleted_cells)
+            self._detected[depleted_cells] = np.bincount(new_cells, minlength=len(depleted))[depleted_cells]
+            points = np.concatenate((points[~depleted[cells]], new_features.reshape(-1, 2)))
+        self._points = points.reshape(-1, 1, 2).astype(np.float32)
+        self._frame = frame
+
+        return self._origins, mean_displacements + self._origins
+
+    def _get_cells(self, points, h, w):
+        rows = np.clip(points[:, 1] // (h // self.n_rows), 0, self.n_rows - 1)
+        cols = np.clip(points[:, 0] // (w // self.n_cols), 0, self.n_cols - 1)
+        return (rows * self.n_cols + cols).astype(np.int64)
@@ -0,0 +1,115 @@
+import time
+from src import profiling
+from src.pipeline import grid_flow_stage, segmentation_stage
+
+
+def budget_stage(timed_frames, latency_budget):
+    """ Yields ((frame_idx, capture_time), frame) tuples for (frame_idx, capture_time, frame) tuples
+    and drops the frames which are older than latency_budget seconds when they are taken.
+    The tuple in place of the frame is passed on by grid_flow_stage and segmentation_stage.
+
+    Dropped frames are skipped by the optical flow as well, it is computed between the frames kept.
+    """
+    for frame_idx, capture_time, frame in timed_frames:
+        if latency_budget is not None and time.perf_counter() - capture_time > latency_budget:
+            continue
+        yield (frame_idx, capture_time), frame
+
+
+class LiveSegmenter:
+    def __init__(self, frame_generator, grid_size, transition_threshold, motion_threshold, flow_mode="block",
+                 latency_budget=0.2):
+        """
+        Segments a live stream frame by frame with the causal segmentation of src.segmnet.
+
+        Parameters
+        ----------
+        frame_generator: FrameGeneratorStream
+            a grayscale frame generator of the stream
+        grid_size: Tuple(int)
+            (n_rows, n_cols) of the optical flow grid
+        transition_threshold: float
+            the threshold parameter for visit segmentation
+        motion_threshold: float
+            the threshold parameter for view segmentation
+        flow_mode: str, Optional
+            optical flow mode, see src.grid_optical_flow.TRACKER_MODES
+        latency_budget: float, Optional
+            frames older than this many seconds when their processing would start are dropped.
+            None processes every frame the generator delivers.
+        """
+        self.frame_generator = frame_generator
+        self.grid_size = grid_size
+        self.transition_threshold = transition_threshold
+        self.motion_threshold = motion_threshold
+        self.flow_mode = flow_mode
+        self.latency_budget = latency_budget
+        self.latency = profiling.StageTimer()
+        self._start = None
+        self._end = None
+
+    def __iter__(self):
+        """ Segments the stream until it ends.
+
+        Returns
+        -------
+        a dictionary for each processed frame with its index in the stream ("frame"), its capture time
+        relative to the first frame ("time"), "is_visit", "view_count" and the time in milliseconds
+        from its capture until its segmentation ("latency_ms").
+        """
+        items = budget_stage(self.frame_generator.iter_timed(), self.latency_budget)
+        items = grid_flow_stage(items, *self.grid_size, mode=self.flow_mode)
+        items = segmentation_stage(items, self.transition_threshold, self.motion_threshold)
+        for (frame_idx, capture_time), is_visit, view_count in items:
+            now = time.perf_counter()
+            if self._start is None:
+                self._start = capture_time
+            self._end = now
+            self.latency.add(now - capture_time)
+            yield {"frame": frame_idx,
+                   "time": capture_time - self._start,
+                   "is_visit": bool(is_visit),
+                   "view_count": int(view_count),
+                   "latency_ms": 1000 * (now - capture_time)}
+
+    def stats(self):
+        """ Returns the number of captured, processed and dropped frames and the latency statistics."""
+        captured = self.frame_generator.captured
+        wall_time = 0.0 if self._start is None else self._end - self._start
+        return {"frames_captured": captured,
+                "frames_processed": self.latency.count,
+                "frames_dropped": captured - self.latency.count,
+                "frames_dropped_by_buffer": self.frame_generator.dropped,
+                "processed_fps": self.latency.count / wall_time if wall_time > 0 else float("nan"),
+                "latency_mean_ms": 1000 * self.latency.total / max(self.latency.count, 1),
+                "latency_p50_ms": 1000 * self.latency.quantile(0.5),
+                "latency_p95_ms": 1000 * self.latency.quantile(0.95),
+                "latency_max_ms": 1000 * self.latency.max}
+
+
+def get_boundary_events(record, previous):
+    """ Returns the segment boundary events of a per-frame record of LiveSegmenter.
+
+    The first frame starts a visit or a transition and a view. Later a "visit_start" or
+    "transition_start" event is emitted when the visit label changes and a "view_start" event
+    when a new view segment starts.
+
+    Parameters
+    ----------
+    record: dict
+        the record of the frame
+    previous: dict
+        the record of the previous processed frame, None for the first frame
+
+    Returns
+    -------
+    a list of event dictionaries with the "event" type, the "frame", "time", "view_count" and
+    "latency_ms" of the frame starting the segment.
+    """
+    events = []
+    if previous is None or record["is_visit"] != previous["is_visit"]:
+        events.append("visit_start" if record["is_visit"] else "transition_start")
+    if previous is None or record["view_count"] != previous["view_count"]:
+        events.append("view_start")
+    return [{"event": event, "frame": record["frame"], "time": record["time"],
+             "view_count": record["view_count"], "latency_ms": record["latency_ms"]} for event in events]
@@ -0,0 +1,179 @@
+import logging
+import numpy as np
+from tqdm import tqdm
+from src.flow_store import FLOW_DTYPE
+from src.grid_optical_flow import GridFlowTracker, get_grid_centres
+from src.segmnet import segment_view_vectors, segment_visit_vectors
+
+
+def _iter_vectors(frames, grid_size, flow_mode):
+    """ Yields the displacement vectors of the grid of every frame pair of an iterable of grayscale frames."""
+    tracker = GridFlowTracker(grid_size[0], grid_size[1], mode=flow_mode)
+    for frame in frames:
+        flow = tracker.update(frame)
+        if flow is not None:
+            origins, displacements = flow
+            yield np.subtract(displacements, origins, dtype=FLOW_DTYPE)
+
+
+def coarse_flow(fg, grid_size, stride, flow_mode="block"):
+    """ Approximate the flow of every frame of a video by sampling it every stride frames.
+
+    The flow between the frames k * stride and k * stride + 1 is computed for every k and it is
+    assigned to the following stride frames, the frames in between are only grabbed. The flow is
+    sampled between consecutive frames rather than between the frames stride apart, which would
+    move the features out of reach of the tracker. The first frame gets the flow of the second
+    frame like in calculate_optica_flow.py.
+
+    Parameters
+    ----------
+    fg: FrameGenerator
+        a grayscale frame generator
+    grid_size: Tuple(int)
+        (n_rows, n_cols) of the grid
+    stride: int
+        number of frames between the samples
+    flow_mode: str, Optional
+        optical flow mode, see src.grid_optical_flow.TRACKER_MODES
+
+    Returns
+    -------
+        a numpy array of shape (frames, n_rows, n_cols, 2) with the displacement vectors of the grid,
+        covering the frames up to the second frame of the last sample.
+    """
+    samples = []
+    with tqdm(desc="coarse pass", unit="frame", total=len(fg) // stride) as progress:
+        while True:
+            frames = list(fg.iter_range(len(samples) * stride, len(samples) * stride + 2))
+            if len(frames) < 2:
+                break
+            samples.extend(_iter_vectors(frames, grid_size, flow_mode))
+            progress.update()
+    samples = np.array(samples, dtype=FLOW_DTYPE).reshape(-1, grid_size[0], grid_size[1], 2)
+    if len(samples) == 0:
+        return samples
+    frame_samples = np.arange((len(samples) - 1) * stride + 1) // stride
+    return samples[np.concatenate(([0], frame_samples))]
+
+
+def exact_flow(fg, grid_size, start, stop=None, flow_mode="block"):
+    """ Compute the flow of the frames start, ..., stop - 1 of a video at full frame rate by seeking.
+
+    Parameters
+    ----------
+    fg: FrameGenerator
+        a grayscale frame generator
+    grid_size: Tuple(int)
+        (n_rows, n_cols) of the grid
+    start: int
+        index of the first frame
+    stop: int, Optional
+        exclusive end of the range, None computes the flow until the end of the video.
+    flow_mode: str, Optional
+        optical flow mode, see src.grid_optical_flow.TRACKER_MODES
+
+    Returns
+    -------
+        a numpy array of shape (frames, n_rows, n_cols, 2) with the displacement vectors of the grid,
+        shorter than the range if the video ends before stop.
+    """
+    # The flow of a frame is computed from the previous frame, frame 0 gets the flow of frame 1.
+    first = max(start - 1, 0)
+    vectors = list(_iter_vectors(fg.iter_range(first, stop), grid_size, flow_mode))
+    if start == 0:
+        vectors = vectors[:1] + vectors
+    return np.array(vectors, dtype=FLOW_DTYPE).reshape(-1, grid_size[0], grid_size[1], 2)
+
+
+def find_boundaries(origins, vectors, transition_threshold, motion_threshold):
+    """ Returns the sorted indices of the frames starting a visit, a transition or a view segment,
+    without the first frame. The flow is given in the layout of src.flow_store.load_flow."""
+    is_visit = segment_visit_vectors(origins, vectors, transition_threshold)
+    is_new_segment = segment_view_vectors(vectors, motion_threshold)
+    is_new_segment[1:] |= is_visit[1:] != is_visit[:-1]
+    return np.flatnonzero(is_new_segment[1:]) + 1
+
+
+def get_runs(mask):
+    """ Returns the (start, stop) ranges of the consecutive True values of a boolean array."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def compute_multires_flow(fg, grid_size, transition_threshold, motion_threshold, stride=10, window=None,
+                          motion_tolerance=0.5, flow_mode="block", max_iterations=4):
+    """ Compute the grid flow of a video sampled every stride frames and compute it at full frame rate
+    around the segment boundaries only.
+
+    The flow is computed at full frame rate with exact_flow wherever the sampled flow (see coarse_flow)
+    changes between two samples, and in a window around each boundary found by the segmentation of the
+    flow. The boundaries of the sampled flow are only known up to the stride, so the segmentation is
+    repeated on the refined flow until every boundary lies in a refined window.
+
+    Parameters
+    ----------
+    fg: FrameGenerator
+        a grayscale frame generator
+    grid_size: Tuple(int)
+        (n_rows, n_cols) of the grid
+    transition_threshold: float
+        the threshold parameter for visit segmentation
+    motion_threshold: float
+        the threshold parameter for view segmentation
+    stride: int, Optional
+        number of frames between the samples of the coarse pass
+    window: int, Optional
+        number of frames refined before and after each boundary, defaults to the stride.
+    motion_tolerance: float, Optional
+        the interval between two samples is refined if the grid displacements of the samples differ by
+        more than this many pixels on average.
+    flow_mode: str, Optional
+        optical flow mode, see src.grid_optical_flow.TRACKER_MODES
+    max_iterations: int, Optional
+        maximum number of refinement rounds.
+
+    Returns
+    -------
+        - a numpy array of shape (n_rows, n_cols, 2) with the grid origins
+        - a numpy array of shape (frames, n_rows, n_cols, 2) with the displacement vectors of the grid
+        of every frame of the video.
+        - a boolean numpy array of shape (frames,) which is True for the frames with full frame rate flow.
+    """
+    origins = get_grid_centres(fg.resolution[1], fg.resolution[0], *grid_size)
+    window = stride if window is None else window
+    vectors = coarse_flow(fg, grid_size, stride, flow_mode)
+    n_sampled = len(vectors)
+    # The frames after the last sample are computed at full frame rate.
+    tail = exact_flow(fg, grid_size, n_sampled, flow_mode=flow_mode)
+    vectors = np.concatenate((vectors, tail))
+    refined = np.zeros(len(vectors), dtype=bool)
+    refined[n_sampled:] = True
+    refined[:2] = True
+    refined[1:n_sampled:stride] = True
+
+    # The sampled flow is exact while the motion is constant, so the intervals between two samples
+    # with different motion are refined as well. Otherwise the boundaries which depend on the motion
+    # cumulated since the last boundary could be off by up to the stride.
+    samples = vectors[1:n_sampled:stride]
+    changes = np.linalg.norm(np.diff(samples, axis=0), axis=-1).mean(axis=(1, 2)) > motion_tolerance
+    windows = np.zeros(len(vectors), dtype=bool)
+    for sample in np.flatnonzero(changes):
+        windows[sample * stride + 2:(sample + 1) * stride + 1] = True
+
+    for iteration in range(max_iterations + 1):
+        for boundary in find_boundaries(origins, vectors, transition_threshold, motion_threshold):
+            windows[max(boundary - window, 0):boundary + window + 1] = True
+        windows &= ~refined
+        if not np.any(windows):
+            break
+        if iteration == max_iterations:
+            logging.warning("Some segment boundaries are not refined after {0} iterations".format(max_iterations))
+            break
+        for start, stop in get_runs(windows):
+            window_vectors = exact_flow(fg, grid_size, start, stop, flow_mode)
+            vectors[start:start + len(window_vectors)] = window_vectors
+            refined[start:stop] = True
+        windows[:] = False
+
+    logging.info("{0} of {1} frames refined at full frame rate".format(refined.sum(), len(vectors)))
+    return origins, vectors, refined
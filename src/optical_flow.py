@@ -1,5 +1,7 @@
 import cv2
+import threading
 import numpy as np
+from src import profiling
 
 k_params = dict(
     winSize=(15, 15),
@@ -9,6 +11,15 @@ k_params = dict(
 
 feature_params = dict(maxCorners=100, qualityLevel=0.3, minDistance=7, blockSize=7)
 
+# The dense flow is computed on frames downscaled to at most max_width pixels wide.
+dense_params = dict(preset=cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST, max_width=320)
+
+# The adaptive grid flow compares the frames downscaled to cell_size x cell_size pixels per grid cell
+# and assumes the cells with a mean absolute difference of at most change_threshold gray levels are static.
+adaptive_params = dict(change_threshold=2.0, cell_size=8)
+
+_dense_flow = threading.local()
+
 def get_displacements(image1, image2):
     """ Calculate the displacement between "good" features 
     given two consecuitive grayscale images.
@@ -27,11 +38,13 @@ def get_displacements(image1, image2):
         - a set of 2D coordinates representing the matching features 
             location in the second image.
     """
-    p1 = cv2.goodFeaturesToTrack(image1, mask=None, **feature_params)
+    with profiling.stage("goodFeaturesToTrack"):
+        p1 = cv2.goodFeaturesToTrack(image1, mask=None, **feature_params)
     if p1 is None:
         return np.array([[0, 0]]), np.array([[0, 0]])
 
-    p2, st, err = cv2.calcOpticalFlowPyrLK(image1, image2, p1, None, **k_params)
+    with profiling.stage("calcOpticalFlowPyrLK"):
+        p2, st, err = cv2.calcOpticalFlowPyrLK(image1, image2, p1, None, **k_params)
     if p2 is None:
         return np.array([[0, 0]]), np.array([[0, 0]])
 
@@ -40,4 +53,163 @@ def get_displacements(image1, image2):
 
     origin = p1[st == 1].reshape(-1, 2)
     dispacement = p2[st == 1].reshape(-1, 2)
-    return origin, dispacement
\ No newline at end of file
+    return origin, dispacement
+
+
+def get_dense_flow(image1, image2, size=None):
+    """ Calculate a dense optical flow between two consecutive grayscale images with DIS.
+
+    Parameters
+    ----------
+    image1: numpy array,
+        First grayscale image
+    image2: numpy array,
+        Second grayscale image
+    size: Tuple(int), Optional
+        (width, height) the images are downscaled to before computing the flow.
+        None keeps the size of the images.
+
+    Returns
+    -------
+        a float32 numpy array of shape (height, width, 2) holding the displacement of each pixel of
+        the (downscaled) first image, measured in pixels of the original images.
+    """
+    # DIS instances keep state between calls, each thread gets its own.
+    if not hasattr(_dense_flow, "dis"):
+        _dense_flow.dis = cv2.DISOpticalFlow_create(dense_params["preset"])
+    scale = None
+    if size is not None and tuple(size) != image1.shape[1::-1]:
+        # The resize can change the aspect ratio, x and y are scaled back separately.
+        scale = np.array([image1.shape[1] / size[0], image1.shape[0] / size[1]], dtype=np.float32)
+        image1 = cv2.resize(image1, tuple(size), interpolation=cv2.INTER_AREA)
+        image2 = cv2.resize(image2, tuple(size), interpolation=cv2.INTER_AREA)
+    with profiling.stage("DISOpticalFlow"):
+        flow = _dense_flow.dis.calc(image1, image2, None)
+    if scale is not None:
+        flow *= scale
+    return flow
+
+
+def get_grid_features(image, n_rows, n_cols, cells=None):
+    """ Detect "good" features on the whole image, or on some of its grid cells, with a per grid cell quota.
+
+    The corner response is computed once for the full image and every grid cell
+    then selects its own corners the way goodFeaturesToTrack selects them: local
+    maxima above the quality level of the cell, taken strongest first while they
+    are at least minDistance away from the corners already kept in the cell. The
+    response near the block borders is computed from the neighbouring pixels
+    instead of a reflected border, so the corners there can differ from the ones
+    goodFeaturesToTrack finds on a separate block.
+
+    Parameters
+    ----------
+    image: numpy array,
+        grayscale image
+    n_rows: int
+        number of rows in the grid
+    n_cols: int
+        number of columns in the grid
+    cells: iterable of int, Optional
+        flat indices of the grid cells to detect the features in, None detects them in every cell.
+        The corner response is then only computed around these cells.
+
+    Returns
+    -------
+        - a numpy array of shape (N, 1, 2) with the feature locations (float32).
+        - a numpy array of shape (N,) with the index of the grid cell each feature belongs to.
+    """
+    with profiling.stage("goodFeaturesToTrack"):
+        return _select_grid_features(image, n_rows, n_cols, cells)
+
+
+def _select_grid_features(image, n_rows, n_cols, cells=None):
+    h, w = image.shape
+    assert h % n_rows == 0, "{} rows is not evenly divisble by {}".format(h, n_rows)
+    assert w % n_cols == 0, "{} cols is not evenly divisble by {}".format(w, n_cols)
+    block_height = h // n_rows
+    block_width = w // n_cols
+
+    if cells is None:
+        response = cv2.cornerMinEigenVal(image, feature_params["blockSize"])
+    else:
+        # The response of the other cells stays zero, which is below any quality level. Each cell is
+        # computed with the margin the Sobel and the blockSize window need to match the full image response.
+        response = np.zeros((h, w), dtype=np.float32)
+        margin = feature_params["blockSize"] // 2 + 1
+        for cell in cells:
+            y, x = (cell // n_cols) * block_height, (cell % n_cols) * block_width
+            y0, x0 = max(y - margin, 0), max(x - margin, 0)
+            roi = cv2.cornerMinEigenVal(image[y0:y + block_height + margin, x0:x + block_width + margin],
+                                        feature_params["blockSize"])
+            response[y:y + block_height, x:x + block_width] = roi[y - y0:y - y0 + block_height,
+                                                                  x - x0:x - x0 + block_width]
+
+    # Candidates are the 3x3 local maxima which are above the quality level of their own cell.
+    cell_response = response.reshape(n_rows, block_height, n_cols, block_width)
+    threshold = cell_response.max(axis=(1, 3)) * feature_params["qualityLevel"]
+    is_corner = (cell_response > threshold[:, None, :, None]).reshape(h, w)
+    is_corner &= response == cv2.dilate(response, None)
+    corners = cv2.findNonZero(is_corner.view(np.uint8))
+    if corners is None:
+        return np.zeros((0, 1, 2), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    corners = corners.reshape(-1, 2)
+    xs, ys = corners[:, 0], corners[:, 1]
+    cells = (ys // block_height) * n_cols + xs // block_width
+    order = np.lexsort((-response[ys, xs], cells))
+    xs, ys, cells = xs[order], ys[order], cells[order]
+
+    keep = _space_features(xs, ys, cells, n_rows * n_cols)
+    points = np.stack((xs[keep], ys[keep]), axis=-1).astype(np.float32).reshape(-1, 1, 2)
+    return points, cells[keep]
+
+
+def _space_features(xs, ys, cells, n_cells):
+    # Greedy minDistance selection of goodFeaturesToTrack, run for all cells at once. The candidates
+    # are sorted by cell and decreasing strength, each round keeps the strongest remaining candidate
+    # of every cell and drops the candidates of the cell closer to it than minDistance.
+    min_distance_2 = feature_params["minDistance"] ** 2
+    keep = []
+    counts = np.zeros(n_cells, dtype=np.int64)
+    remaining = np.arange(len(cells))
+    while len(remaining):
+        remaining_cells = cells[remaining]
+        first = np.ones(len(remaining), dtype=bool)
+        first[1:] = remaining_cells[1:] != remaining_cells[:-1]
+        kept = remaining[first]
+        keep.append(kept)
+        counts[cells[kept]] += 1
+
+        kept_x = np.zeros(n_cells, dtype=np.int64)
+        kept_y = np.zeros(n_cells, dtype=np.int64)
+        kept_x[cells[kept]], kept_y[cells[kept]] = xs[kept], ys[kept]
+        remaining, remaining_cells = remaining[~first], remaining_cells[~first]
+        distance_2 = (xs[remaining] - kept_x[remaining_cells]) ** 2 + (ys[remaining] - kept_y[remaining_cells]) ** 2
+        remaining = remaining[(distance_2 >= min_distance_2) &
+                              (counts[remaining_cells] < feature_params["maxCorners"])]
+    return np.sort(np.concatenate(keep))
+
+
+def track_features(image1, image2, points):
+    """ Track a set of features from image1 to image2 with a single pyramidal LK call.
+
+    Parameters
+    ----------
+    image1: numpy array,
+        First grayscale image
+    image2: numpy array,
+        Second grayscale image
+    points: numpy array,
+        Feature locations on the first image with shape (N, 1, 2) and dtype float32.
+
+    Returns
+    -------
+        - a numpy array of shape (N, 2) with the new feature locations on the second image.
+        - a boolean numpy array of shape (N,) which is True where the feature was found.
+    """
+    if len(points) == 0:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros(0, dtype=bool)
+    with profiling.stage("calcOpticalFlowPyrLK"):
+        p2, st, err = cv2.calcOpticalFlowPyrLK(image1, image2, points, None, **k_params)
+    if p2 is None:
+        return np.zeros((len(points), 2), dtype=np.float32), np.zeros(len(points), dtype=bool)
+    return p2.reshape(-1, 2), st.reshape(-1) == 1
\ No newline at end of file
@@ -0,0 +1,128 @@
+import logging
+import math
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from src.video import get_video_info, get_keyframe_index
+from src.frame_generator import FrameGeneratorVideo
+from src.grid_optical_flow import GridFlowTracker
+
+
+def split_frame_range(frame_count, n_chunks):
+    """ Split the frames of a video into consecutive ranges which overlap by one frame,
+    so the flow of the frame pair on each chunk boundary is computed as well.
+
+    Parameters
+    ----------
+    frame_count: int
+        number of frames in the video
+    n_chunks: int
+        number of ranges to create
+
+    Returns
+    -------
+        a list of (start, stop) tuples. stop is exclusive and it is None for the last range
+        meaning that the range lasts until the end of the video.
+    """
+    n_chunks = max(1, min(n_chunks, frame_count - 1))
+    bounds = [round(i * (frame_count - 1) / n_chunks) for i in range(n_chunks + 1)]
+    ranges = [(start, stop + 1) for start, stop in zip(bounds[:-1], bounds[1:])]
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def _compute_chunk_flow(video, start, stop, n_rows, n_cols, mode, working_resolution):
+    """ Compute the grid flow of the frame pairs in the range [start, stop) of a video. """
+    fg = FrameGeneratorVideo(video, show_video_info=False, working_resolution=working_resolution,
+                             grid_size=(n_rows, n_cols), grayscale=True)
+
+    tracker = GridFlowTracker(n_rows, n_cols, mode=mode)
+    origins, displacements = [], []
+    for frame in fg.iter_range(start, stop):
+        flow = tracker.update(frame)
+        if flow is not None:
+            origins.append(flow[0])
+            displacements.append(flow[1])
+    return origins, displacements
+
+
+def iter_grid_flow_parallel(video, grid_size, workers, mode="block", working_resolution=None, start_frame=0,
+                            chunk_size=None):
+    """ Compute the grid flow of a video with a pool of processes, each working on its own
+    range of frames with its own video capture, and yield it in frame order as the ranges finish.
+
+    Parameters
+    ----------
+    video: str
+        path to the video file
+    grid_size: Tuple(int)
+        number of rows and columns of the grid
+    workers: int
+        number of worker processes
+    mode: str, Optional
+        optical flow mode, see compute_grid_flow_parallel.
+    working_resolution: Tuple(int), Optional
+        (width, height) the frames are resized to, see FrameGeneratorVideo.
+    start_frame: int, Optional
+        index of the first frame, the flow of the frame pairs after it is computed.
+    chunk_size: int, Optional
+        the video is split into ranges of at most this many frame pairs, but at least into one range per
+        worker. At most two ranges per worker are computed ahead of the one being yielded, so the flow
+        arrives in steps of chunk_size frames and only those ranges are kept in memory.
+        None splits the video into one range per worker.
+
+    Returns
+    -------
+        (origins, displacements) tuples of the frame pairs
+    """
+    if mode == "tracked":
+        logging.warning("Features are re-detected at the start of each chunk in tracked mode.")
+    _, frame_count, _, _, _, _ = get_video_info(video)
+    # Build the keyframe index once before the workers seek into the video.
+    get_keyframe_index(video)
+    n_chunks = workers
+    if chunk_size is not None:
+        n_chunks = max(workers, math.ceil((frame_count - start_frame - 1) / chunk_size))
+    ranges = deque(split_frame_range(frame_count - start_frame, n_chunks))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=len(ranges), desc="computing chunks", unit="chunk") as progress:
+        futures = deque()
+        while ranges or futures:
+            while ranges and len(futures) < 2 * workers:
+                start, stop = ranges.popleft()
+                futures.append(executor.submit(_compute_chunk_flow, video, start_frame + start,
+                                               None if stop is None else start_frame + stop, grid_size[0],
+                                               grid_size[1], mode, working_resolution))
+            yield from zip(*futures.popleft().result())
+            progress.update()
+
+
+def compute_grid_flow_parallel(video, grid_size, workers, mode="block", working_resolution=None):
+    """ Compute the grid flow of a video with a pool of processes, each working on its own
+    range of frames with its own video capture.
+
+    Parameters
+    ----------
+    video: str
+        path to the video file
+    grid_size: Tuple(int)
+        number of rows and columns of the grid
+    workers: int
+        number of worker processes
+    mode: str, Optional
+        optical flow mode, see src.grid_optical_flow.TRACKER_MODES. In "tracked" mode every
+        chunk starts with a new set of features, so the result can slightly differ from a serial run.
+    working_resolution: Tuple(int), Optional
+        (width, height) the frames are resized to, see FrameGeneratorVideo.
+
+    Returns
+    -------
+        - a list of the grid origins of each frame pair
+        - a list of the displaced grid origins of each frame pair
+    """
+    origins, displacements = [], []
+    for flow in iter_grid_flow_parallel(video, grid_size, workers, mode=mode, working_resolution=working_resolution):
+        origins.append(flow[0])
+        displacements.append(flow[1])
+    return origins, displacements
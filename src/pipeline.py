@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+from functools import lru_cache
+from itertools import tee
+from src import profiling
+from src.grid_optical_flow import GridFlowTracker
+from src.segmnet import iter_segment_view, iter_segment_visit
+
+OUTPUT_FRAME_SIZE = (400, 400)
+LABEL_COLOR = (209, 80, 0, 255)
+# Height of the strip at the top of the frame the labels are written on.
+LABEL_HEIGHT = 60
+
+
+def grayscale_stage(frames):
+    """ Yields (frame, gray_frame) tuples for BGR frames."""
+    for frame in frames:
+        with profiling.stage("color conversion"):
+            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        yield frame, gray_frame
+
+
+def grid_flow_stage(items, n_rows, n_cols, mode="block"):
+    """ Yields (frame, origins, displacements) tuples for (frame, gray_frame) tuples.
+
+    The first frame gets the optical flow of the second frame, so it is held back until
+    the flow between the first two frames is known.
+    """
+    tracker = GridFlowTracker(n_rows, n_cols, mode=mode)
+    first_frame = None
+    for frame, gray_frame in items:
+        flow = tracker.update(gray_frame)
+        if flow is None:
+            first_frame = frame
+            continue
+        if first_frame is not None:
+            yield (first_frame, *flow)
+            first_frame = None
+        yield (frame, *flow)
+
+
+def segmentation_stage(items, transition_threshold, motion_threshold):
+    """ Yields (frame, is_visit, view_count) tuples for (frame, origins, displacements) tuples.
+
+    view_count is the index of the view segment the frame belongs to. A new view segment
+    starts when segment_view detects one or when the visit label changes.
+    """
+    items, flow = tee(items)
+    visit_flow, view_flow = tee((origins, displacements) for _, origins, displacements in flow)
+    visits = iter_segment_visit(visit_flow, transition_threshold)
+    new_segments = iter_segment_view(view_flow, motion_threshold)
+
+    view_count = 0
+    previous_visit = None
+    for (frame, _, _), is_visit, is_new_segment in zip(items, visits, new_segments):
+        view_count += int(is_new_segment)
+        view_count += 0 if previous_visit is None else int(previous_visit != is_visit)
+        previous_visit = is_visit
+        yield frame, is_visit, view_count
+
+
+@lru_cache(maxsize=64)
+def _label_masks(is_visit, view_count):
+    """ The covered pixels of each line of the segmentation labels and their coverage, rendered once for
+    each label. putText may anti-alias, so the coverage is kept instead of a binary mask."""
+    transition_text = "In visit:{}".format(str(is_visit))
+    motion_segment_text = "sgmt:{}".format(str(view_count))
+    masks = np.zeros((2, LABEL_HEIGHT, OUTPUT_FRAME_SIZE[0]), dtype=np.uint8)
+    cv2.putText(masks[0], transition_text, (0, 20), cv2.FONT_HERSHEY_SIMPLEX, 1, 255, 3)
+    cv2.putText(masks[1], motion_segment_text, (0, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, 255, 3)
+    masks = masks.reshape(2, -1)
+    return [(np.flatnonzero(mask), mask[mask > 0].astype(np.float32)[:, None] / 255) for mask in masks]
+
+
+def annotate_frame(frame, is_visit, view_count):
+    """ Returns the downscaled frame with the segmentation labels written on it.
+
+    The labels are blended from cached masks in the order putText would draw them, which gives
+    the same pixels as drawing them on each frame.
+    """
+    with profiling.stage("annotation"):
+        frame = cv2.resize(frame, OUTPUT_FRAME_SIZE)
+        color = np.float32(LABEL_COLOR[:frame.shape[2]] if frame.ndim == 3 else LABEL_COLOR[:1])
+        label = frame[:LABEL_HEIGHT].reshape(LABEL_HEIGHT * OUTPUT_FRAME_SIZE[0], -1)
+        for pixels, coverage in _label_masks(bool(is_visit), int(view_count)):
+            values = label[pixels].astype(np.float32)
+            label[pixels] = np.round(values + (color - values) * coverage)
+    return frame
+
+
+def draw_flow(frame, origins, displacements):
+    """ Returns the frame downscaled to OUTPUT_FRAME_SIZE with the grid flow drawn on it.
+
+    The flow is drawn after downscaling, with the line width scaled accordingly.
+    """
+    with profiling.stage("annotation"):
+        h, w = frame.shape[0:2]
+        scale = np.array(OUTPUT_FRAME_SIZE) / (w, h)
+        frame = cv2.resize(frame, OUTPUT_FRAME_SIZE, interpolation=cv2.INTER_AREA)
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        thickness = max(1, int(round(5 * scale.mean())))
+        origins = np.reshape(origins, (-1, 2)) * scale
+        displacements = np.reshape(displacements, (-1, 2)) * scale
+        for v0, v1 in zip(origins.astype(int), displacements.astype(int)):
+            frame = cv2.line(frame, tuple(v0), tuple(v1), (0, 255, 0), thickness=thickness)
+            frame = cv2.circle(frame, tuple(v0), thickness, (0, 0, 255), -1)
+    return frame
+
+
+def flow_store_stage(items, store):
+    """ Appends the flow of (frame, origins, displacements) tuples to a FlowStoreWriter
+    and passes the tuples on."""
+    for frame, origins, displacements in items:
+        store.append(origins, displacements)
+        yield frame, origins, displacements
@@ -0,0 +1,186 @@
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_right
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+# Upper bounds of the histogram bins of the stage timings, 1us to 100s on a log scale.
+_BIN_EDGES = np.logspace(-6, 2, 161).tolist()
+
+_profiler = None
+
+
+class StageTimer:
+    """ Running statistics of the durations of a stage. The durations are binned into a log scale
+    histogram so the quantiles can be estimated without keeping every duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(_BIN_EDGES) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[bisect_right(_BIN_EDGES, seconds)] += 1
+
+    def quantile(self, q):
+        """ Returns the upper bound of the histogram bin holding the q quantile."""
+        position = np.searchsorted(np.cumsum(self.histogram), q * self.count)
+        return min(_BIN_EDGES[min(position, len(_BIN_EDGES) - 1)], self.max)
+
+
+class Profiler:
+    def __init__(self):
+        """ Collects the durations of the stages of a run. Stages running on different threads
+        are recorded as well, their durations overlap with the wall time of the run."""
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def record(self, name, seconds):
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageTimer()
+            self.stages[name].add(seconds)
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """ Returns the wall time, the peak memory usage, the statistics of every stage and the counters.
+
+        Returns
+        -------
+            a dictionary, the "stages" entry is a list with one dictionary per stage.
+        """
+        wall_time = time.perf_counter() - self._start
+        stages = []
+        for name, timer in sorted(self.stages.items(), key=lambda item: -item[1].total):
+            stages.append({"stage": name,
+                           "calls": timer.count,
+                           "total_s": timer.total,
+                           "share_of_wall_time": timer.total / wall_time,
+                           "mean_ms": 1000 * timer.total / timer.count,
+                           "p50_ms": 1000 * timer.quantile(0.5),
+                           "p95_ms": 1000 * timer.quantile(0.95),
+                           "max_ms": 1000 * timer.max})
+        return {"wall_time_s": wall_time,
+                "peak_rss_mb": peak_rss() / 2 ** 20,
+                "peak_rss_children_mb": peak_rss(children=True) / 2 ** 20,
+                "stages": stages,
+                "counters": dict(self.counters)}
+
+    def save(self, output_dir, name):
+        """ Save the report as <name>_profile.json and the stage statistics as <name>_profile.csv."""
+        import pandas as pd
+
+        report = self.report()
+        with open(os.path.join(output_dir, "{}_profile.json".format(name)), "w") as handle:
+            json.dump(report, handle, indent=2)
+        pd.DataFrame(report["stages"]).to_csv(os.path.join(output_dir, "{}_profile.csv".format(name)), index=False)
+        return report
+
+
+def peak_rss(children=False):
+    """ Returns the peak resident set size of the process (or of its terminated children) in bytes,
+    NaN where the resource module is not available (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+def enable():
+    """ Start recording the stages, returns the Profiler."""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def stage(name):
+    """ Record the duration of the with block as a stage, if profiling is enabled.
+
+    When profiling is disabled a shared no-op context manager is returned, which costs a function
+    call and the empty __enter__ and __exit__ calls.
+
+    Example
+    -------
+        with profiling.stage("decode"):
+            ret, frame = cap.read()
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NO_STAGE
+    return _timed_stage(profiler, name)
+
+
+_NO_STAGE = nullcontext()
+
+
+@contextmanager
+def _timed_stage(profiler, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.record(name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    """ Add value to a counter of the report, e.g. the number of skipped items, if profiling is enabled."""
+    profiler = _profiler
+    if profiler is not None:
+        profiler.count(name, value)
+
+
+@contextmanager
+def profile_run(output_dir, name, enabled=True, cprofile=False):
+    """ Profile the stages of the with block and save the report in output_dir.
+
+    Parameters
+    ----------
+    output_dir: str
+        folder of the report
+    name: str
+        prefix of the report files
+    enabled: bool, Optional
+        if False nothing is recorded
+    cprofile: bool, Optional
+        if True the with block also runs under cProfile and the statistics are dumped to <name>.prof
+    """
+    if not enabled and not cprofile:
+        yield
+        return
+    enable()
+    profile = cProfile.Profile() if cprofile else None
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(os.path.join(output_dir, "{}.prof".format(name)))
+        report = _profiler.save(output_dir, name)
+        disable()
+        logging.info("Profile: wall time {0:.1f}s, peak RSS {1:.0f}MB, report saved to {2}".format(
+            report["wall_time_s"], report["peak_rss_mb"], os.path.join(output_dir, "{}_profile.json".format(name))))
@@ -1,37 +1,221 @@
 import numpy as np
+from scipy.signal import lfilter
 from tqdm import tqdm
 import logging
-from src.camera_motion import estimate_z_transition
+from src import profiling
+from src.camera_motion import CameraMotionModel, estimate_z_transition_batch
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
 
 
 def segment_view(optical_flow, threshold):
-    origins = optical_flow[0]
-    displacements = optical_flow[1]
+    flow = tqdm(zip(optical_flow[:, 0], optical_flow[:, 1]), desc="Segmenting", unit="frame")
+    return iter_segment_view(flow, threshold)
+
+
+def iter_segment_view(flow, threshold):
+    """ Same as segment_view but it consumes the flow frame by frame.
+
+    Parameters
+    ----------
+    flow: iterable
+        yields the (origins, displacements) tuple of each frame
+    threshold: float
+        the threshold parameter for view segmentation
+    """
     cumulated = None
-    for origin, displacement in tqdm(zip(origins, displacements), desc="Segmenting", unit="frame"):
-        if cumulated is None:
-            cumulated = displacement-origin
-        else:
-            cumulated += displacement-origin
-        magnitudes = np.sqrt(np.sum(np.power(cumulated, 2), axis=2))
-        mean_magnitude = np.mean(magnitudes)
-        if mean_magnitude > threshold:
-            cumulated = None
+    for origin, displacement in flow:
+        with profiling.stage("segmentation"):
+            if cumulated is None:
+                cumulated = displacement-origin
+            else:
+                cumulated += displacement-origin
+            magnitudes = np.sqrt(np.sum(np.power(cumulated, 2), axis=2))
+            mean_magnitude = np.mean(magnitudes)
+            if mean_magnitude > threshold:
+                cumulated = None
         yield mean_magnitude > threshold
     pass
 
 
 def segment_visit(optical_flow, threshold, smooth_factor=0.99):
-    origins = optical_flow[0]
-    displacements = optical_flow[1]
-    smoothed_displacement = displacements[0]
-    for origin, displacement in tqdm(zip(origins, displacements), desc="Segmenting", unit="frame"):
-        smoothed_displacement = smooth_factor * smoothed_displacement + (1 - smooth_factor) * displacement
-        z_transition = estimate_z_transition(origin, smoothed_displacement)
+    flow = tqdm(zip(optical_flow[:, 0], optical_flow[:, 1]), desc="Segmenting", unit="frame")
+    return iter_segment_visit(flow, threshold, smooth_factor)
+
+
+def iter_segment_visit(flow, threshold, smooth_factor=0.99):
+    """ Same as segment_visit but it consumes the flow frame by frame.
+
+    Parameters
+    ----------
+    flow: iterable
+        yields the (origins, displacements) tuple of each frame
+    threshold: float
+        the threshold parameter for visit segmentation
+    smooth_factor: float, Optional
+        factor of the exponential smoothing applied on the displacements
+    """
+    smoothed_displacement = None
+    model, model_origin = None, None
+    for origin, displacement in flow:
+        with profiling.stage("segmentation"):
+            # The origins are the same grid for every frame, the model is only built again if they change.
+            if model is None or (origin is not model_origin and not np.array_equal(origin, model_origin)):
+                model, model_origin = CameraMotionModel(origin), origin
+            displacement = np.asarray(displacement, dtype=np.float64)
+            if smoothed_displacement is None:
+                smoothed_displacement = displacement
+            smoothed_displacement = smooth_factor * smoothed_displacement + (1 - smooth_factor) * displacement
+            z_transition = model.z_transition(smoothed_displacement)
         yield z_transition < threshold
     pass
 
 
+def _mean_magnitudes(cumulated):
+    """ Mean magnitude of the cumulated grid displacements of each frame in a batch."""
+    magnitudes = np.sqrt(np.sum(np.power(cumulated, 2), axis=-1))
+    return np.mean(magnitudes.reshape(len(magnitudes), -1), axis=1)
+
+
+def segment_view_batch(optical_flow, threshold, chunk_size=16):
+    """ Same as segment_view but it segments the whole flow at once.
+
+    The displacements are cumulated with cumsum over chunks of frames and the chunk grows
+    until the cumulated magnitude exceeds the threshold. The cumulation then restarts after
+    that frame.
+
+    Parameters
+    ----------
+    optical_flow: numpy array
+        flow of shape (frames, 2, n_rows, n_cols, 2)
+    threshold: float
+        the threshold parameter for view segmentation
+    chunk_size: int, Optional
+        number of frames cumulated at once at the start of the first segment. Later segments
+        start with the length of the previous segment.
+
+    Returns
+    -------
+        a boolean numpy array of shape (frames,) which is True where a new view segment starts.
+    """
+    return segment_view_vectors(optical_flow[:, 1] - optical_flow[:, 0], threshold, chunk_size)
+
+
+def segment_view_vectors(vectors, threshold, chunk_size=16):
+    """ Same as segment_view_batch but it takes the displacement vectors of the grid
+    (displaced origins - origins) of shape (frames, n_rows, n_cols, 2), so they can be
+    computed once and segmented with many thresholds.
+    """
+    n_frames = len(vectors)
+    is_new_segment = np.zeros(n_frames, dtype=bool)
+    start = 0
+    while start < n_frames:
+        cumulated = None
+        pos = start
+        size = chunk_size
+        while pos < n_frames:
+            stop = min(pos + size, n_frames)
+            if cumulated is None:
+                sums = np.cumsum(vectors[pos:stop], axis=0)
+            else:
+                # cumulate on top of the previous chunk the same way segment_view does
+                sums = np.cumsum(np.concatenate((cumulated[None], vectors[pos:stop])), axis=0)[1:]
+            exceeded = np.flatnonzero(_mean_magnitudes(sums) > threshold)
+            if len(exceeded) > 0:
+                is_new_segment[pos + exceeded[0]] = True
+                # the next segment is expected to be about as long as this one
+                chunk_size = pos + exceeded[0] + 1 - start
+                start += chunk_size
+                break
+            cumulated = sums[-1]
+            pos = stop
+            size *= 2
+        else:
+            break
+    return is_new_segment
+
+
+def segment_visit_batch(optical_flow, threshold, smooth_factor=0.99):
+    """ Same as segment_visit but it segments the whole flow at once.
+
+    The exponential smoothing of the displacements is done with a single lfilter call and the
+    camera transition is estimated for all frames at once.
+
+    Parameters
+    ----------
+    optical_flow: numpy array
+        flow of shape (frames, 2, n_rows, n_cols, 2)
+    threshold: float
+        the threshold parameter for visit segmentation
+    smooth_factor: float, Optional
+        factor of the exponential smoothing applied on the displacements
+
+    Returns
+    -------
+        a boolean numpy array of shape (frames,) which is True for frames in a visit.
+    """
+    z_transitions = smoothed_z_transitions(optical_flow, smooth_factor)
+    return z_transitions < threshold
+
+
+def segment_visit_vectors(origins, vectors, threshold, smooth_factor=0.99):
+    """ Same as segment_visit_batch but it takes the grid origins shared by all frames of shape
+    (n_rows, n_cols, 2) and the displacement vectors of the grid of shape (frames, n_rows, n_cols, 2),
+    the layout of the flow files, see src.flow_store.load_flow.
+    """
+    return smoothed_z_transitions_vectors(origins, vectors, smooth_factor) < threshold
+
+
+def smoothed_z_transitions(optical_flow, smooth_factor=0.99):
+    """ The camera transition on the z axis estimated for each frame from the exponentially
+    smoothed displacements, as segment_visit computes it.
+
+    Parameters
+    ----------
+    optical_flow: numpy array
+        flow of shape (frames, 2, n_rows, n_cols, 2)
+    smooth_factor: float, Optional
+        factor of the exponential smoothing applied on the displacements
+
+    Returns
+    -------
+        a numpy array of shape (frames,)
+    """
+    displacements = np.asarray(optical_flow[:, 1], dtype=np.float64)
+    initial = smooth_factor * displacements[:1]
+    smoothed, _ = lfilter([1 - smooth_factor], [1, -smooth_factor], displacements, axis=0, zi=initial)
+    return estimate_z_transition_batch(optical_flow[:, 0], smoothed)
+
+
+def smoothed_z_transitions_vectors(origins, vectors, smooth_factor=0.99):
+    """ Same as smoothed_z_transitions but it takes the grid origins shared by all frames and the
+    displacement vectors of the grid, see segment_visit_vectors.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    initial = smooth_factor * vectors[:1]
+    smoothed, _ = lfilter([1 - smooth_factor], [1, -smooth_factor], vectors, axis=0, zi=initial)
+    # The smoothing is linear, smoothing the displaced origins is the same as moving the origins
+    # by the smoothed vectors.
+    smoothed += origins
+    return estimate_z_transition_batch(origins, smoothed)
+
+
+def count_view_segments(is_visit, is_new_segment):
+    """ Index of the view segment of each frame. A new view segment starts where segment_view
+    detects one and where the visit label changes.
+
+    Parameters
+    ----------
+    is_visit: numpy array
+        visit labels of shape (frames,) or (n_settings, frames)
+    is_new_segment: numpy array
+        view segmentation of shape (frames,) or (n_settings, frames)
 
+    Returns
+    -------
+        a numpy array of the same shape holding the view segment index of each frame.
+    """
+    is_visit = np.asarray(is_visit)
+    visit_changes = np.zeros(is_visit.shape, dtype=int)
+    visit_changes[..., 1:] = is_visit[..., 1:] != is_visit[..., :-1]
+    return np.cumsum(np.asarray(is_new_segment, dtype=int) + visit_changes, axis=-1)
@@ -1,24 +1,46 @@
 import numpy as np
 import pandas as pd
 
+
+def _run_boundaries(labels):
+    """ Run-length encode a label sequence.
+
+    Returns
+    -------
+        a numpy array with the first frame of each run of equal labels followed by len(labels).
+    """
+    labels = np.asarray(labels)
+    changes = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    return np.concatenate(([0], changes, [len(labels)])).astype(np.int64)
+
+
+def _merge_short_runs(boundaries, min_length):
+    """ Remove the runs shorter than min_length by merging them with their neighbours.
+
+    The runs are visited from the first to the last. A short run is merged together with the
+    runs before and after it, the last run is merged into the previous one. Runs which were
+    already checked are never shorter than min_length, so a single pass with a stack is enough.
+    """
+    last = len(boundaries) - 1
+    merged = []
+    for i, boundary in enumerate(boundaries):
+        merged.append(boundary)
+        if len(merged) > 1 and merged[-1] - merged[-2] < min_length:
+            if i == last:
+                del merged[-2]
+            else:
+                del merged[-2:]
+    return merged
+
+
 def visit_sparse_segmentation_to_df(labels, min_length):
-    segmentation = np.where(np.diff(labels) != 0)[0]+1
-    segmentation = np.insert(segmentation, 0, 0)
-    segmentation = np.insert(segmentation, len(segmentation), len(labels))
-    while np.any(np.diff(segmentation) < min_length):
-        to_delete = np.where(np.diff(segmentation) < min_length)[0][0]
-        segmentation = np.delete(segmentation, to_delete)
-        if to_delete != len(segmentation)-1:
-            segmentation = np.delete(segmentation, to_delete)
-    segmentation = segmentation[1:-1]
-    segmentation = np.repeat(segmentation, 2)
-    segmentation = np.insert(segmentation, 0, 0)
-    segmentation = np.insert(segmentation, len(segmentation), len(labels))
-    segmentation = np.reshape(segmentation, (-1, 2))
-
-    new_labels = []
-    for s in segmentation:
-        new_labels.append("visit" if labels[s[0]] else "transition")
+    labels = np.asarray(labels)
+    boundaries = _merge_short_runs(_run_boundaries(labels), min_length)[1:-1]
+    segmentation = np.empty((len(boundaries) + 1, 2), dtype=np.int64)
+    segmentation[:, 0] = [0, *boundaries]
+    segmentation[:, 1] = [*boundaries, len(labels)]
+
+    new_labels = np.where(labels[segmentation[:, 0]], "visit", "transition").tolist()
 
     d = {'Start frame': segmentation[:, 0], 'End frame': segmentation[:, 1], "Type": new_labels}
     df = pd.DataFrame(data=d)
@@ -26,20 +48,10 @@ def visit_sparse_segmentation_to_df(labels, min_length):
 
 
 def view_sparse_segmentation_to_df(labels, min_length):
-    segmentation = np.where(np.diff(labels) != 0)[0]+1
-    segmentation = np.repeat(segmentation, 2)
-    segmentation = np.insert(segmentation, 0, 0)
-    segmentation = np.insert(segmentation, len(segmentation), len(labels))
-    segmentation = np.reshape(segmentation, (-1, 2))
-    to_delete = []
-    for i, s in enumerate(segmentation):
-        if s[1]-s[0] < min_length:
-            to_delete.append(i)
-    segmentation = np.delete(segmentation, to_delete,axis=0)
-    segmentation = np.reshape(segmentation, (-1, 2))
+    boundaries = _run_boundaries(labels)
+    segmentation = np.stack((boundaries[:-1], boundaries[1:]), axis=-1)
+    segmentation = segmentation[segmentation[:, 1] - segmentation[:, 0] >= min_length]
 
     d = {'Start frame': segmentation[:, 0], 'End frame': segmentation[:, 1]}
     df = pd.DataFrame(data=d)
     return df
-
-
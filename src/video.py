@@ -1,7 +1,13 @@
 import cv2
 import datetime
+import json
+import logging
+import os
+import queue
+import threading
 from typing import Tuple
 from tabulate import tabulate
+from src import profiling
 
 def prettify_video_info(video_file: str, frame_count: int, fps: int, length: float, width:int, height:int):
     """ Returns a prettified formatted string with all the video data.
@@ -41,3 +47,114 @@ def get_video_info(video_file: str) -> Tuple[str, int, int, float, int, int]:
     fps    = cap.get(cv2.CAP_PROP_FPS)
     length = frame_count/fps
     return video_file, frame_count, fps, length, height, width
+
+
+def get_keyframe_file(video_file: str) -> str:
+    """ Returns the path of the keyframe index cached next to a video file."""
+    return video_file + ".keyframes.json"
+
+
+def _scan_keyframes(video_file: str):
+    """ Returns the indices of the keyframes of a video by demuxing its packets without
+    decoding them, or None if the opencv backend can not report keyframes.
+    """
+    has_key_frame = getattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME", None)
+    if has_key_frame is None:
+        return None
+    cap = cv2.VideoCapture(video_file, cv2.CAP_FFMPEG)
+    if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+        cap.release()
+        return None
+    keyframes = []
+    frame_idx = 0
+    while cap.grab():
+        if cap.get(has_key_frame):
+            keyframes.append(frame_idx)
+        frame_idx += 1
+    cap.release()
+    return keyframes if keyframes and keyframes[0] == 0 else None
+
+
+def get_keyframe_index(video_file: str):
+    """ Returns the indices of the keyframes of a video. The index is built once and cached
+        next to the video file, it is rebuilt when the size or the modification time of the video changes.
+
+    :param video_file: path to the video file.
+    :return: a sorted list of keyframe indices or None if the keyframes can not be determined.
+    """
+    stat = os.stat(video_file)
+    key = {"size": stat.st_size, "mtime": stat.st_mtime}
+    keyframe_file = get_keyframe_file(video_file)
+    if os.path.isfile(keyframe_file):
+        with open(keyframe_file, "r") as handle:
+            try:
+                index = json.load(handle)
+            except ValueError:
+                index = {}
+        if all(index.get(k) == v for k, v in key.items()):
+            return index["keyframes"]
+
+    keyframes = _scan_keyframes(video_file)
+    try:
+        tmp_file = "{0}.{1}.tmp".format(keyframe_file, os.getpid())
+        with open(tmp_file, "w") as handle:
+            json.dump(dict(key, keyframes=keyframes), handle)
+        os.replace(tmp_file, keyframe_file)
+    except OSError as e:
+        logging.warning("could not cache the keyframe index of {0}: {1}".format(video_file, e))
+    return keyframes
+
+
+class AsyncVideoWriter:
+    """ A cv2.VideoWriter which encodes the frames on a background thread.
+
+    Frames passed to write are queued (at most queue_size of them) and must not be modified
+    afterwards. With queue_size=0 the frames are written synchronously.
+
+    If render is given, write takes a tuple of arguments of render instead of a frame, and the
+    frame returned by render is written. The rendering then runs on the background thread too.
+    """
+
+    def __init__(self, filename: str, fourcc: int, fps: float, frame_size: Tuple[int, int], queue_size: int = 8,
+                 render=None):
+        self._writer = cv2.VideoWriter(filename, fourcc, fps, frame_size)
+        self._render = render
+        self._frames = None
+        self._error = None
+        if queue_size > 0:
+            self._frames = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._write_frames, daemon=True)
+            self._thread.start()
+
+    def _write_frames(self):
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                return
+            try:
+                self._write(frame)
+            except Exception as e:
+                self._error = e
+
+    def _write(self, frame):
+        if self._render is not None:
+            frame = self._render(*frame)
+        with profiling.stage("encode"):
+            self._writer.write(frame)
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        if self._frames is None:
+            self._write(frame)
+        else:
+            self._frames.put(frame)
+
+    def release(self):
+        """ Waits until all the queued frames are written and closes the video file."""
+        if self._frames is not None:
+            self._frames.put(None)
+            self._thread.join()
+        self._writer.release()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,91 @@
+import argparse
+import itertools
+import logging
+import os
+import textwrap
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from src.flow_store import load_flow
+from src.segmnet import smoothed_z_transitions_vectors, segment_view_vectors, count_view_segments
+from src.utils import view_sparse_segmentation_to_df, visit_sparse_segmentation_to_df
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                     description=textwrap.dedent(
+                                         '''evaluate the segmentation of a video with many parameter settings'''))
+    parser.add_argument('--optical-flow-file', '-f', type=str, help="path to the optical flow file")
+    parser.add_argument('--transition-thresholds', nargs="+", type=float,
+                        help="The threshold parameters for visit segmentation")
+    parser.add_argument('--motion-thresholds', nargs="+", type=float,
+                        help="The threshold parameters for view segmentation")
+    parser.add_argument('--min_view_section_lengths', nargs="+", type=float, default=[25],
+                        help="The minimum number of frames a view has to contain")
+    parser.add_argument('--min_visit_section_lengths', nargs="+", type=float, default=[75],
+                        help="The minimum number of frames a visit has to contain")
+    parser.add_argument("--output-dir", "-o", type=str,
+                        help="Folder where the sweep results are saved")
+
+    args = parser.parse_args()
+    return args
+
+
+def _segment_lengths(df):
+    return (df["End frame"] - df["Start frame"]).to_numpy()
+
+
+def sweep_segmentation(optical_flow_file, transition_thresholds, motion_thresholds, min_view_section_lengths,
+                       min_visit_section_lengths, output_dir):
+    origins, vectors, _ = load_flow(optical_flow_file)
+
+    # Threshold independent quantities are computed only once.
+    z_transitions = smoothed_z_transitions_vectors(origins, vectors)
+    vectors = np.asarray(vectors)
+
+    # Visit labels of every transition threshold at once, shape (n_thresholds, frames).
+    visits = z_transitions[None, :] < np.array(transition_thresholds)[:, None]
+    new_segments = np.array([segment_view_vectors(vectors, threshold) for threshold in motion_thresholds])
+
+    # The visit segments only depend on the transition threshold and the min visit section length.
+    visit_segments = {}
+    for i, min_visit_section_length in itertools.product(range(len(transition_thresholds)), min_visit_section_lengths):
+        visit_df = visit_sparse_segmentation_to_df(visits[i], min_visit_section_length)
+        visit_segments[i, min_visit_section_length] = (_segment_lengths(visit_df[visit_df["Type"] == "visit"]),
+                                                       _segment_lengths(visit_df[visit_df["Type"] == "transition"]))
+
+    rows = []
+    settings = itertools.product(enumerate(transition_thresholds), enumerate(motion_thresholds))
+    for (i, transition_threshold), (j, motion_threshold) in tqdm(settings, desc="Sweeping",
+                                                                 total=len(transition_thresholds) * len(motion_thresholds)):
+        view_segmentation = count_view_segments(visits[i], new_segments[j])
+        for min_view_section_length, min_visit_section_length in itertools.product(min_view_section_lengths,
+                                                                                   min_visit_section_lengths):
+            view_df = view_sparse_segmentation_to_df(view_segmentation, min_view_section_length)
+            view_lengths = _segment_lengths(view_df)
+            visit_lengths, transition_lengths = visit_segments[i, min_visit_section_length]
+            rows.append({"Transition threshold": transition_threshold,
+                         "Motion threshold": motion_threshold,
+                         "Min view section length": min_view_section_length,
+                         "Min visit section length": min_visit_section_length,
+                         "View segments": len(view_lengths),
+                         "Average view segment length": view_lengths.mean() if len(view_lengths) else np.nan,
+                         "Visit segments": len(visit_lengths),
+                         "Average visit segment length": visit_lengths.mean() if len(visit_lengths) else np.nan,
+                         "Transition segments": len(transition_lengths),
+                         "Average transition segment length":
+                             transition_lengths.mean() if len(transition_lengths) else np.nan})
+
+    df = pd.DataFrame(rows)
+    df.to_csv(os.path.join(output_dir, "segmentation_sweep.csv"), index=False)
+    logging.info("Sweep Done!")
+    return df
+
+
+if __name__ == "__main__":
+    args = parseargs()
+    sweep_segmentation(**args.__dict__)
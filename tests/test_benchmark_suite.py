@@ -0,0 +1,14 @@
+from benchmarks.benchmark_suite import benchmark_video
+from benchmarks.synthetic import make_video
+
+
+def test_benchmark_checks(tmp_path):
+    video_file = str(tmp_path / "synthetic.avi")
+    ground_truth = make_video(video_file, (320, 240), 150)
+    _, _, checks = benchmark_video(video_file, ground_truth, flow_frames=5)
+    assert checks["segment_view_batch_matches"]
+    assert checks["segment_visit_batch_matches"]
+    assert checks["camera_motion_model_z_matches"]
+    # The segmentation has to label the video into several segments, otherwise the checks above are vacuous.
+    assert checks["visit_segments"] > 1
+    assert checks["view_segments"] > 1
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from src.camera_motion import CameraMotionModel, estimate_z_transition
+from src.grid_optical_flow import get_grid_centres
+
+
+@pytest.fixture(scope="module")
+def origins():
+    return get_grid_centres(240, 320, 5, 10)
+
+
+def test_z_transition_matches_estimate_z_transition(origins):
+    rng = np.random.RandomState(0)
+    displacements = origins + rng.normal(scale=2.0, size=(20,) + origins.shape)
+    model = CameraMotionModel(origins)
+    expected = np.array([estimate_z_transition(origins, d) for d in displacements])
+    assert np.allclose(model.z_transition(displacements), expected)
+    assert np.allclose([model.z_transition(d) for d in displacements], expected)
+    assert np.allclose(model.estimate_motion(displacements)[:, 0], expected)
+
+
+def test_estimate_motion_of_a_pan(origins):
+    model = CameraMotionModel(origins)
+    motion = model.estimate_motion(origins + np.array([3.0, -2.0]))
+    assert motion.shape == (4,)
+    assert np.allclose(motion[1:3], [3.0, -2.0])
+    assert abs(motion[3]) < 1e-9
+
+
+def test_estimate_motion_of_a_rotation_and_a_zoom(origins):
+    model = CameraMotionModel(origins)
+    centre = np.array([160.0, 120.0])
+    angle = 0.01
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    rotated = (origins - centre) @ rotation.T + centre
+    static = model.estimate_motion(origins)
+    motion = model.estimate_motion(rotated + 0.02 * (origins - centre))
+    assert motion[3] == pytest.approx(angle, rel=0.01)
+    assert np.allclose(motion[1:3], 0, atol=1e-6)
+    assert motion[0] > static[0]
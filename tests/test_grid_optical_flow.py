@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import src.grid_optical_flow
+from benchmarks.synthetic import make_video
+from src.frame_generator import FrameGeneratorVideo
+from src.grid_optical_flow import GridFlowTracker, get_grid_flow
+from src.optical_flow import feature_params, get_grid_features
+
+GRID_SIZE = (5, 8)
+RESOLUTION = (320, 240)
+N_FRAMES = 150
+
+
+@pytest.fixture(scope="module")
+def frames(tmp_path_factory):
+    video_file = str(tmp_path_factory.mktemp("video") / "synthetic.avi")
+    make_video(video_file, RESOLUTION, N_FRAMES)
+    return [*FrameGeneratorVideo(video_file, show_video_info=False, grid_size=GRID_SIZE, grayscale=True)]
+
+
+@pytest.fixture
+def detections(monkeypatch):
+    # The cells of each feature detection of the tracker, None for the whole frame.
+    calls = []
+
+    def counting_get_grid_features(image, n_rows, n_cols, cells=None):
+        calls.append(None if cells is None else [*cells])
+        return get_grid_features(image, n_rows, n_cols, cells)
+    monkeypatch.setattr(src.grid_optical_flow, "get_grid_features", counting_get_grid_features)
+    return calls
+
+
+@pytest.mark.parametrize("flat", [False, True])
+def test_tracker_detects_features_in_depleted_cells_only(frames, detections, flat):
+    n_rows, n_cols = GRID_SIZE
+    block_height, block_width = frames[0].shape[0] // n_rows, frames[0].shape[1] // n_cols
+    tracker = GridFlowTracker(n_rows, n_cols)
+    for frame in frames:
+        if flat:
+            frame = frame.copy()
+            # The flat area reaches into the neighbouring cells, so the first cell has no corners on its border.
+            margin = 2 * feature_params["blockSize"]
+            frame[:block_height + margin, :block_width + margin] = 128
+        tracker.update(frame)
+
+    assert detections[0] is None
+    redetected = detections[1:]
+    assert all(cells is not None for cells in redetected)
+    assert len(redetected) < len(frames) // 2
+    assert sum(map(len, redetected)) < 0.05 * n_rows * n_cols * len(frames)
+    if flat:
+        # The flat cell is only retried periodically.
+        assert sum(0 in cells for cells in redetected) <= len(frames) // tracker.empty_retry_interval
+
+
+def test_tracker_detects_features_after_a_flat_first_frame(frames):
+    n_rows, n_cols = GRID_SIZE
+    tracker = GridFlowTracker(n_rows, n_cols)
+    tracker.update(np.zeros_like(frames[0]))
+    for frame in frames[:31]:
+        tracker.update(frame)
+    # The frames 25 to 50 of the synthetic video are translated.
+    for p_frame, frame in zip(frames[30:40], frames[31:41]):
+        origins, displacements = tracker.update(frame)
+        expected_origins, expected_displacements = get_grid_flow(p_frame, frame, n_rows, n_cols)
+        flow = (displacements - origins).mean(axis=(0, 1))
+        assert np.linalg.norm(flow) > 1
+        assert np.allclose(flow, (expected_displacements - expected_origins).mean(axis=(0, 1)), atol=0.5)
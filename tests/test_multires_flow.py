@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_video
+from src.frame_generator import FrameGeneratorVideo
+from src.grid_optical_flow import get_grid_centres
+from src.multires_flow import compute_multires_flow, exact_flow, find_boundaries
+
+GRID_SIZE = (5, 8)
+RESOLUTION = (160, 120)
+THRESHOLDS = [(1.0, 20), (1.0002, 30), (0.9999, 50)]
+
+
+@pytest.fixture(scope="module")
+def frame_generator(tmp_path_factory):
+    video_file = str(tmp_path_factory.mktemp("video") / "synthetic.avi")
+    make_video(video_file, RESOLUTION, 300)
+    return FrameGeneratorVideo(video_file, show_video_info=False, grid_size=GRID_SIZE, grayscale=True)
+
+
+@pytest.fixture(scope="module")
+def full_rate_flow(frame_generator):
+    return exact_flow(frame_generator, GRID_SIZE, 0)
+
+
+@pytest.mark.parametrize("transition_threshold, motion_threshold", THRESHOLDS)
+def test_boundaries_match_full_rate_flow(frame_generator, full_rate_flow, transition_threshold, motion_threshold):
+    origins = get_grid_centres(RESOLUTION[1], RESOLUTION[0], *GRID_SIZE)
+    expected = find_boundaries(origins, full_rate_flow, transition_threshold, motion_threshold)
+    # The 1% zoom of the synthetic video moves the grid by less than the default tolerance at this
+    # resolution, the tolerance is lowered so every change of the motion is refined.
+    origins, vectors, refined = compute_multires_flow(frame_generator, GRID_SIZE, transition_threshold,
+                                                      motion_threshold, stride=10, motion_tolerance=0.25)
+    assert len(expected) > 0
+    assert not refined.all()
+    assert np.array_equal(find_boundaries(origins, vectors, transition_threshold, motion_threshold), expected)
+    assert np.array_equal(vectors[refined], full_rate_flow[refined])
+
+
+@pytest.mark.parametrize("transition_threshold, motion_threshold", THRESHOLDS)
+def test_boundaries_are_refined_without_motion_changes(frame_generator, transition_threshold, motion_threshold):
+    # Without the refinement of the motion changes the boundaries of the sampled flow are refined.
+    origins, vectors, refined = compute_multires_flow(frame_generator, GRID_SIZE, transition_threshold,
+                                                      motion_threshold, stride=10, motion_tolerance=np.inf)
+    boundaries = find_boundaries(origins, vectors, transition_threshold, motion_threshold)
+    assert len(boundaries) > 0
+    assert refined[boundaries].all()
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import make_texture
+from src.grid_optical_flow import split
+from src.optical_flow import feature_params, get_dense_flow, get_grid_features
+
+GRID_SIZE = (4, 5)
+RESOLUTION = (320, 240)
+
+
+def test_grid_features_match_good_features_to_track():
+    image = make_texture(*RESOLUTION, seed=1)
+    n_rows, n_cols = GRID_SIZE
+    block_height, block_width = RESOLUTION[1] // n_rows, RESOLUTION[0] // n_cols
+    points, cells = get_grid_features(image, n_rows, n_cols)
+    points = points.reshape(-1, 2)
+    # The corner response differs near the block borders and the corners there suppress their neighbours
+    # within minDistance, only the inner corners are compared.
+    margin = feature_params["blockSize"] + feature_params["minDistance"]
+
+    n_expected = n_matched = 0
+    for cell, block in enumerate(split(image, n_rows, n_cols)):
+        offset = np.array([(cell % n_cols) * block_width, (cell // n_cols) * block_height])
+        expected = cv2.goodFeaturesToTrack(block, mask=None, **feature_params).reshape(-1, 2)
+        selected = points[cells == cell] - offset
+        assert len(selected) <= feature_params["maxCorners"]
+        distances = np.linalg.norm(selected[:, None] - selected[None], axis=-1)
+        assert distances[~np.eye(len(selected), dtype=bool)].min() >= feature_params["minDistance"]
+
+        def inner(p):
+            return p[np.all((p >= margin) & (p < np.array([block_width, block_height]) - margin), axis=1)]
+        expected, selected = {*map(tuple, inner(expected))}, {*map(tuple, inner(selected))}
+        n_expected += len(expected)
+        n_matched += len(expected & selected)
+    assert n_expected > 0
+    assert n_matched >= 0.85 * n_expected
+
+
+def test_dense_flow_is_scaled_per_axis():
+    texture = make_texture(*RESOLUTION, seed=2)
+    shift = np.float32([[1, 0, 8], [0, 1, 8]])
+    moved = cv2.warpAffine(texture, shift, RESOLUTION, borderMode=cv2.BORDER_REFLECT)
+    # Halves the width and divides the height by 3.
+    size = (RESOLUTION[0] // 2, RESOLUTION[1] // 3)
+    flow = get_dense_flow(texture, moved, size)
+    assert flow.shape == (size[1], size[0], 2)
+    inner = flow[size[1] // 4:-size[1] // 4, size[0] // 4:-size[0] // 4].reshape(-1, 2)
+    assert np.allclose(np.median(inner, axis=0), [8, 8], atol=0.5)
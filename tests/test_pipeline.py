@@ -0,0 +1,18 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.pipeline import annotate_frame, LABEL_COLOR, OUTPUT_FRAME_SIZE
+
+
+@pytest.mark.parametrize("shape", [(480, 640, 3), (480, 640)])
+@pytest.mark.parametrize("is_visit, view_count", [(True, 0), (False, 12), (True, 345)])
+def test_annotate_frame_matches_put_text(shape, is_visit, view_count):
+    frame = (np.random.RandomState(view_count).rand(*shape) * 255).astype(np.uint8)
+    color = LABEL_COLOR if frame.ndim == 3 else LABEL_COLOR[0]
+    expected = cv2.resize(frame, OUTPUT_FRAME_SIZE)
+    expected = cv2.putText(expected, "In visit:{}".format(is_visit), (0, 20), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 3)
+    expected = cv2.putText(expected, "sgmt:{}".format(view_count), (0, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 3)
+    # Twice, the second time from the cached masks.
+    for _ in range(2):
+        assert np.array_equal(annotate_frame(frame.copy(), is_visit, view_count), expected)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from src.grid_optical_flow import get_grid_centres
+from src.segmnet import (segment_view, segment_view_batch, segment_view_vectors, segment_visit,
+                         segment_visit_batch, segment_visit_vectors)
+
+N_FRAMES = 400
+GRID_SIZE = (5, 10)
+
+
+@pytest.fixture(scope="module")
+def optical_flow():
+    """ Seeded synthetic flow of shape (frames, 2, n_rows, n_cols, 2) alternating between static,
+    panning and zooming phases with noise on top."""
+    rng = np.random.RandomState(0)
+    origins = get_grid_centres(240, 320, *GRID_SIZE).astype(np.float64)
+    centre = origins.mean(axis=(0, 1))
+    vectors = rng.normal(scale=0.3, size=(N_FRAMES,) + origins.shape)
+    for start in range(0, N_FRAMES, 50):
+        phase = (start // 50) % 4
+        if phase == 1:
+            vectors[start:start + 50] += rng.uniform(-4, 4, size=2)
+        elif phase == 3:
+            vectors[start:start + 50] += rng.uniform(-0.03, 0.03) * (origins - centre)
+    flow = np.empty((N_FRAMES, 2) + origins.shape, dtype=np.float32)
+    flow[:, 0] = origins
+    flow[:, 1] = origins + vectors
+    return flow
+
+
+@pytest.mark.parametrize("threshold", [5, 20, 50, 200])
+def test_segment_view_batch_matches_segment_view(optical_flow, threshold):
+    is_new_segment = np.array(list(segment_view(optical_flow, threshold)))
+    assert is_new_segment.any()
+    assert np.array_equal(is_new_segment, segment_view_batch(optical_flow, threshold))
+    assert np.array_equal(is_new_segment, segment_view_vectors(optical_flow[:, 1] - optical_flow[:, 0], threshold))
+
+
+@pytest.mark.parametrize("threshold", [1.0002, 1.001, 1.003, 1.005])
+def test_segment_visit_batch_matches_segment_visit(optical_flow, threshold):
+    is_visit = np.array(list(segment_visit(optical_flow, threshold)))
+    assert is_visit.any() and not is_visit.all()
+    assert np.array_equal(is_visit, segment_visit_batch(optical_flow, threshold))
+    assert np.array_equal(is_visit, segment_visit_vectors(optical_flow[0, 0], optical_flow[:, 1] - optical_flow[:, 0],
+                                                          threshold))
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import view_sparse_segmentation_to_df, visit_sparse_segmentation_to_df
+
+
+def reference_visit_sparse_segmentation_to_df(labels, min_length):
+    # The loop-based converter the linear-time one replaced.
+    segmentation = np.where(np.diff(labels) != 0)[0] + 1
+    segmentation = np.insert(segmentation, 0, 0)
+    segmentation = np.insert(segmentation, len(segmentation), len(labels))
+    while np.any(np.diff(segmentation) < min_length):
+        to_delete = np.where(np.diff(segmentation) < min_length)[0][0]
+        segmentation = np.delete(segmentation, to_delete)
+        if to_delete != len(segmentation) - 1:
+            segmentation = np.delete(segmentation, to_delete)
+    segmentation = segmentation[1:-1]
+    segmentation = np.repeat(segmentation, 2)
+    segmentation = np.insert(segmentation, 0, 0)
+    segmentation = np.insert(segmentation, len(segmentation), len(labels))
+    segmentation = np.reshape(segmentation, (-1, 2))
+    new_labels = ["visit" if labels[s[0]] else "transition" for s in segmentation]
+    return pd.DataFrame(data={'Start frame': segmentation[:, 0], 'End frame': segmentation[:, 1],
+                              "Type": new_labels})
+
+
+def reference_view_sparse_segmentation_to_df(labels, min_length):
+    segmentation = np.where(np.diff(labels) != 0)[0] + 1
+    segmentation = np.repeat(segmentation, 2)
+    segmentation = np.insert(segmentation, 0, 0)
+    segmentation = np.insert(segmentation, len(segmentation), len(labels))
+    segmentation = np.reshape(segmentation, (-1, 2))
+    to_delete = [i for i, s in enumerate(segmentation) if s[1] - s[0] < min_length]
+    segmentation = np.reshape(np.delete(segmentation, to_delete, axis=0), (-1, 2))
+    return pd.DataFrame(data={'Start frame': segmentation[:, 0], 'End frame': segmentation[:, 1]})
+
+
+def random_runs(rng, n_runs, max_length):
+    lengths = rng.randint(1, max_length + 1, size=n_runs)
+    return np.repeat(np.arange(n_runs) % 2 == 0, lengths)
+
+
+def runs(*lengths):
+    return np.repeat(np.arange(len(lengths)) % 2 == 0, lengths)
+
+
+EDGE_CASES = [
+    runs(1),                   # a single frame
+    runs(3, 4, 2, 5),          # every run is short
+    runs(2, 30, 30),           # short first run
+    runs(30, 30, 2),           # short last run
+    runs(2, 30, 3, 30, 2),     # short runs at both ends and in between
+    runs(40),                  # a single long run
+    runs(10, 10),              # exactly min_length long runs
+]
+
+
+def _assert_converters_match(labels, min_length):
+    pd.testing.assert_frame_equal(visit_sparse_segmentation_to_df(labels, min_length),
+                                  reference_visit_sparse_segmentation_to_df(labels, min_length),
+                                  check_dtype=False)
+    view_labels = np.cumsum(np.concatenate(([0], labels[1:] != labels[:-1])))
+    pd.testing.assert_frame_equal(view_sparse_segmentation_to_df(view_labels, min_length),
+                                  reference_view_sparse_segmentation_to_df(view_labels, min_length),
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize("labels", EDGE_CASES)
+def test_converters_match_reference_on_edge_cases(labels):
+    _assert_converters_match(labels, 10)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_converters_match_reference_on_random_runs(seed):
+    rng = np.random.RandomState(seed)
+    labels = random_runs(rng, rng.randint(1, 60), rng.choice([5, 20, 50]))
+    _assert_converters_match(labels, rng.choice([1, 5, 10, 25]))